@@ -100,8 +100,8 @@ def start_detection():
         global VIDEO_PATH
         VIDEO_PATH = video_path
         
-        # Start detection process
-        speed_detector.process_video(video_path)
+        # Start detection process, a request thread cannot open display windows
+        speed_detector.process_video(video_path, headless=True)
         plate_detector.process_speeding_vehicles()
         
         return jsonify({'message': 'Detection process started successfully'})
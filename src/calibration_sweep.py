@@ -0,0 +1,182 @@
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from config import *
+from speed_detection import SpeedDetector
+from replay_cache import load_recording
+
+# Calibration parameters the sweep can vary, with their SpeedDetector arguments
+SWEEP_PARAMETERS = ('pixels_per_meter', 'speed_factor', 'speed_limit', 'speed_filter', 'smoothing_window',
+                    'accel_noise', 'measurement_noise')
+
+# Parameters of one speed filter, ignored with the other
+FILTER_PARAMETERS = {
+    'kalman': ('accel_noise', 'measurement_noise'),
+    'mean': ('smoothing_window',)
+}
+
+def load_ground_truth(csv_path):
+    """Read reference speeds, keyed by track_id or by timestamp in seconds into the video"""
+    with open(csv_path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    if not rows or 'speed_kmh' not in rows[0] or not ({'track_id', 'timestamp'} & set(rows[0])):
+        raise ValueError(f"{csv_path} needs a speed_kmh column and a track_id or timestamp column")
+
+    return [{
+        'track_id': int(row['track_id']) if row.get('track_id') else None,
+        'timestamp': float(row['timestamp']) if row.get('timestamp') else None,
+        'speed_kmh': float(row['speed_kmh'])
+    } for row in rows]
+
+def match_ground_truth(ground_truth, summaries, frame_times, tolerance=SWEEP_MATCH_TOLERANCE):
+    """Pair every reference speed with the track it measured, as (reference, summary) tuples"""
+    by_id = {summary['track_id']: summary for summary in summaries}
+    pairs = []
+    for reading in ground_truth:
+        if reading['track_id'] is not None:
+            match = by_id.get(reading['track_id'])
+        else:
+            # The track in view at the reading's time, closest to the middle of its span
+            match, best = None, None
+            for summary in summaries:
+                start, end = frame_times[summary['first_frame']], frame_times[summary['last_frame']]
+                if start - tolerance <= reading['timestamp'] <= end + tolerance:
+                    distance = abs(reading['timestamp'] - (start + end) / 2)
+                    if best is None or distance < best:
+                        match, best = summary, distance
+        if match is not None:
+            pairs.append((reading['speed_kmh'], match))
+    return pairs
+
+def evaluate(params, recording_path, ground_truth):
+    """Replay the recording with one parameter set and score its speeds against the ground truth"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        arguments = {name: value for name, value in params.items() if value is not None}
+        detector = SpeedDetector(output_dir=output_dir, load_detector=False, **arguments)
+        results = detector.replay(recording_path)
+        summaries = [summary for summary in detector.load_track_summaries() if summary['speeds']]
+
+    recording = load_recording(recording_path)
+    frame_times = dict(zip(recording['frame_indices'].tolist(), recording['timestamps'].tolist()))
+    pairs = match_ground_truth(ground_truth, summaries, frame_times)
+
+    stats = dict(params)
+    stats.update({
+        'tracks': len(summaries),
+        'matched': len(pairs),
+        'unmatched': len(ground_truth) - len(pairs),
+        'violations': results['speeding_vehicles']
+    })
+    if not pairs:
+        stats.update({'mae_kmh': None, 'rmse_kmh': None, 'bias_kmh': None, 'mape_percent': None,
+                      'max_abs_error_kmh': None, 'true_violations': 0, 'missed_violations': 0,
+                      'false_violations': 0})
+        return stats
+
+    reference = np.array([speed for speed, _ in pairs])
+    estimate = np.array([summary['average_speed'] for _, summary in pairs])
+    errors = estimate - reference
+
+    # A matched track counts as a violation the way save_speeding_data counts it
+    flagged = np.array([summary['track_id'] in results['speeding_vehicle_ids'] for _, summary in pairs])
+    speeding = reference > params['speed_limit']
+    stats.update({
+        'mae_kmh': round(float(np.abs(errors).mean()), 2),
+        'rmse_kmh': round(float(np.sqrt((errors ** 2).mean())), 2),
+        'bias_kmh': round(float(errors.mean()), 2),
+        'mape_percent': round(float((np.abs(errors) / np.maximum(reference, 1e-6)).mean() * 100), 1),
+        'max_abs_error_kmh': round(float(np.abs(errors).max()), 2),
+        'true_violations': int(speeding.sum()),
+        'missed_violations': int((speeding & ~flagged).sum()),
+        'false_violations': int((~speeding & flagged).sum())
+    })
+    return stats
+
+def init_worker():
+    """Keep each worker single-threaded and quiet, the pool provides the parallelism"""
+    cv2.setNumThreads(1)
+    logging.getLogger().setLevel(logging.WARNING)
+
+def sweep_combinations(grid):
+    """Every distinct parameter set of the grid, with the parameters its speed filter ignores set to None"""
+    combinations = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid, values))
+        for speed_filter, names in FILTER_PARAMETERS.items():
+            if params.get('speed_filter', SPEED_FILTER) != speed_filter:
+                params.update(dict.fromkeys(names))
+        if params not in combinations:
+            combinations.append(params)
+    return combinations
+
+def run_sweep(recording_path, ground_truth, grid, workers=None):
+    """Evaluate every combination of the grid over a process pool, best mean absolute error first"""
+    combinations = sweep_combinations(grid)
+    workers = min(workers or SWEEP_WORKERS or os.cpu_count(), len(combinations))
+    logging.info(f"Evaluating {len(combinations)} parameter sets with {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        results = list(pool.map(evaluate, combinations, itertools.repeat(recording_path),
+                                    itertools.repeat(ground_truth)))
+
+    return sorted(results, key=lambda stats: (stats['mae_kmh'] is None, stats['mae_kmh'] or 0))
+
+def save_results(results, output_dir):
+    """Write the sweep results as JSON and CSV"""
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, 'sweep_results.json')
+    with open(json_path, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    csv_path = os.path.join(output_dir, 'sweep_results.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    return json_path, csv_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibration Sweep over Recorded Tracker Output')
+    parser.add_argument('--recording', type=str, default=RECORDING_PATH,
+                        help='Tracker output saved with speed_detection.py --record')
+    parser.add_argument('--ground-truth', type=str, default=GROUND_TRUTH_CSV,
+                        help='CSV with speed_kmh and a track_id or timestamp column')
+    parser.add_argument('--pixels-per-meter', type=float, nargs='+', default=[PIXELS_PER_METER])
+    parser.add_argument('--speed-factor', type=float, nargs='+', default=[SPEED_FACTOR])
+    parser.add_argument('--speed-limit', type=float, nargs='+', default=[SPEED_LIMIT])
+    parser.add_argument('--speed-filter', choices=('kalman', 'mean'), nargs='+', default=[SPEED_FILTER])
+    parser.add_argument('--smoothing-window', type=int, nargs='+', default=[SPEED_SMOOTHING_WINDOW],
+                        help='Moving average lengths, swept with the mean speed filter')
+    parser.add_argument('--accel-noise', type=float, nargs='+', default=[KALMAN_ACCEL_NOISE],
+                        help='Kalman process noise in m/s^2, swept with the kalman speed filter')
+    parser.add_argument('--measurement-noise', type=float, nargs='+', default=[KALMAN_MEASUREMENT_NOISE],
+                        help='Kalman position noise in m, swept with the kalman speed filter')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name in SWEEP_PARAMETERS}
+    ground_truth = load_ground_truth(args.ground_truth)
+
+    start_time = time.time()
+    results = run_sweep(args.recording, ground_truth, grid, args.workers)
+    json_path, csv_path = save_results(results, os.path.join(OUTPUT_DIR, 'calibration'))
+
+    logging.info(f"Evaluated {len(results)} parameter sets in {time.time() - start_time:.1f}s")
+    for stats in results[:5]:
+        params = ", ".join(f"{name}={stats[name]}" for name in SWEEP_PARAMETERS
+                           if stats[name] is not None)
+        logging.info(f"{params}: MAE {stats['mae_kmh']} km/h, bias {stats['bias_kmh']} km/h, "
+                     f"{stats['violations']} violations ({stats['missed_violations']} missed, "
+                     f"{stats['false_violations']} false)")
+    logging.info(f"Sweep results saved to {json_path} and {csv_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 from datetime import datetime
 import logging
 from config import *
@@ -9,6 +10,7 @@ import argparse
 import qrcode
 import base64
 from io import BytesIO
+from event_log import tail_events
 
 # Configure logging
 logging.basicConfig(
@@ -38,15 +40,32 @@ class ChallanGenerator:
             logging.error(f"Error loading speed data: {str(e)}")
             return {'vehicle_speeds': {}}
             
-    def load_plate_data(self):
-        """Load plate data from JSON file"""
+    def load_plate_results(self):
+        """Load the results license_plate_detection.py saves"""
         try:
-            with open(os.path.join(OUTPUT_DIR, 'plates', 'plate_data.json'), 'r') as f:
+            with open(os.path.join(OUTPUT_DIR, 'plates', 'plate_detection_results.json'), 'r') as f:
                 return json.load(f)
         except Exception as e:
             logging.error(f"Error loading plate data: {str(e)}")
             return {}
             
+    def load_plate_data(self):
+        """Load the plate detections of every vehicle, keyed by vehicle ID"""
+        return self.load_plate_results().get('vehicle_details', {})
+        
+    def wait_for_plates(self, vehicle_id, timeout=PLATE_WAIT_TIMEOUT):
+        """Reload the plate data once the plate follower has read every evidence image of a vehicle"""
+        deadline = time.time() + timeout
+        results = self.load_plate_results()
+        while vehicle_id not in results.get('finalized_vehicles', []):
+            if time.time() >= deadline:
+                logging.warning(f"Plates of vehicle {vehicle_id} not read within {timeout}s, "
+                                f"is license_plate_detection.py --follow running?")
+                break
+            time.sleep(0.5)
+            results = self.load_plate_results()
+        self.plate_data = results.get('vehicle_details', {})
+            
     def calculate_fine(self, speed):
         """Calculate fine based on speed with improved structure"""
         from config import BASE_SPEED_LIMIT, BASE_FINE
@@ -315,9 +334,10 @@ Traffic Police Department
         """Generate challans for all speeding vehicles"""
         try:
             generated_ids = []
-            # Get all vehicle IDs from speed data where speed exceeds limit
+            # Get all vehicle IDs from speed data where speed exceeds limit and the
+            # detector was confident about it (older speed data has no violation flag)
             for vehicle_id, data in self.speed_data.get('vehicle_speeds', {}).items():
-                if data.get('average_speed', 0) >= BASE_SPEED_LIMIT:
+                if data.get('average_speed', 0) >= BASE_SPEED_LIMIT and data.get('violation', True):
                     challan_id = self.generate_challan(vehicle_id)
                     if challan_id:
                         generated_ids.append(challan_id)
@@ -329,16 +349,49 @@ Traffic Police Department
             logging.error(f"Error generating all challans: {str(e)}")
             return []
             
+    def process_event_stream(self, events_path):
+        """Generate challans as the speed detector finalizes speeding vehicles"""
+        logging.info(f"Following detection events in {events_path}")
+        generated_ids = []
+        
+        for event in tail_events(events_path, idle_timeout=EVENT_TAIL_IDLE_TIMEOUT):
+            if event['event'] != 'track_finalize' or not event['speeds']:
+                continue
+            if event['average_speed'] < BASE_SPEED_LIMIT:
+                continue
+            if not event.get('violation', True):
+                # The detector's speed was never confidently above its limit
+                continue
+            
+            vehicle_id = str(event['track_id'])
+            self.speed_data.setdefault('vehicle_speeds', {})[vehicle_id] = {
+                'speeds': event['speeds'],
+                'average_speed': event['average_speed'],
+                'max_speed': event['max_speed'],
+                'violation': event.get('violation', True)
+            }
+            
+            # The plate follower reads the vehicle's evidence after the detector writes it
+            self.wait_for_plates(vehicle_id)
+            challan_id = self.generate_challan(vehicle_id)
+            if challan_id:
+                generated_ids.append(challan_id)
+        
+        logging.info(f"Generated {len(generated_ids)} challans from the event stream")
+        return generated_ids
+    
     def export_challan_data(self):
         """Export challan data to JSON file"""
         try:
             challan_data = {}
-            for vehicle_id, data in self.plate_data.items():
-                if data.get('plates'):
+            for vehicle_id, plates in self.plate_data.items():
+                if plates:
+                    best_detection = max(plates, key=lambda x: x['confidence'])
+                    average_speed = self.speed_data.get('vehicle_speeds', {}).get(vehicle_id, {}).get('average_speed', 0)
                     challan_data[vehicle_id] = {
-                        'plate_text': data['plates'][0].get('plate_text', '') if data['plates'] else '',
-                        'average_speed': data.get('average_speed', 0),
-                        'fine_amount': self.calculate_fine(data.get('average_speed', 0)),
+                        'plate_text': best_detection.get('plate_text', ''),
+                        'average_speed': average_speed,
+                        'fine_amount': self.calculate_fine(average_speed),
                         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                     }
                 
@@ -354,11 +407,17 @@ def main():
     parser = argparse.ArgumentParser(description='Challan Generation System')
     parser.add_argument('--vehicle-id', type=str, help='Specific vehicle ID to generate challan for')
     parser.add_argument('--all', action='store_true', help='Generate challans for all speeding vehicles')
+    parser.add_argument('--follow', action='store_true',
+                        help='Tail the speed detection event log and generate challans while detection runs')
+    parser.add_argument('--events', type=str, default=os.path.join(OUTPUT_DIR, 'speeding', 'events.jsonl'),
+                        help='Event log written by speed detection')
     args = parser.parse_args()
     
     generator = ChallanGenerator()
     
-    if args.vehicle_id:
+    if args.follow:
+        generator.process_event_stream(args.events)
+    elif args.vehicle_id:
         # Generate challan for specific vehicle
         vehicle_id = args.vehicle_id
         logging.info(f"Generating challan for vehicle ID: {vehicle_id}")
@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import cv2
+from config import *
+
+def run_name(video_path=None, started=None):
+    """Name of a run, the stem of its video or stream and its start time"""
+    stem = os.path.splitext(os.path.basename(str(video_path or '').rstrip('/')))[0]
+    stem = re.sub(r'[^\w.-]', '_', stem) or 'run'
+    return f"{stem}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(started))}"
+
+def clip_name(run, track_id):
+    """File name of a violation clip, prefixed with its run so a later run never overwrites it"""
+    return f"{run}_vehicle_{track_id}_clip.mp4"
+
+def clip_track_id(name):
+    """Track ID of a clip file named by clip_name"""
+    return int(name[name.rindex('_vehicle_') + len('_vehicle_'):-len('_clip.mp4')])
+
+class ClipRecorder:
+    """Memory-bounded ring buffer of recent encoded frames for violation clips.
+
+    Frames are kept JPEG-encoded for the length of a clip within a hard byte
+    budget. When the budget is hit, the oldest frames are dropped early and
+    counted. A violation schedules a clip from pre_seconds before it to
+    post_seconds after it, written on a background thread once the frames
+    after the violation are in the buffer, so the video is never decoded twice.
+    """
+
+    def __init__(self, output_dir, events=None, run=None, budget_mb=CLIP_BUFFER_MB, pre_seconds=CLIP_PRE_SECONDS,
+                 post_seconds=CLIP_POST_SECONDS, quality=CLIP_JPEG_QUALITY):
+        self.output_dir = output_dir
+        self.run = run or run_name()
+        self.events = events
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.quality = quality
+        self.frames = deque()  # (timestamp, encoded frame), oldest first
+        self.buffered_bytes = 0
+        self.dropped_frames = 0
+        self.pending = []  # (track_id, violation timestamp) waiting for their later frames
+        # Violations are triggered from the track stage. A clip moves from pending
+        # to writes under the lock, so holding it a clip is always in one of them.
+        self.lock = threading.Lock()
+        # The writes have their own lock, as drain() waits on them with the lock held
+        self.writes_lock = threading.Lock()
+        self.writes = set()
+        self.clips_written = 0
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clips')
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def evict(self):
+        _, encoded = self.frames.popleft()
+        self.buffered_bytes -= encoded.nbytes
+
+    def trigger(self, track_id, timestamp):
+        """Schedule a clip around the violation of a track at timestamp"""
+        with self.lock:
+            self.pending.append((track_id, timestamp))
+
+    def push(self, frame, timestamp):
+        """Encode a frame into the buffer and start the clips that are now complete"""
+        _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.frames.append((timestamp, encoded))
+        self.buffered_bytes += encoded.nbytes
+
+        # Frames older than a clip are no longer needed
+        while timestamp - self.frames[0][0] > self.pre_seconds + self.post_seconds:
+            self.evict()
+
+        # Over budget, drop frames that a clip could still have used
+        while self.buffered_bytes > self.budget_bytes:
+            self.evict()
+            self.dropped_frames += 1
+            if not self.frames:
+                break
+
+        with self.lock:
+            due = [clip for clip in self.pending if timestamp - clip[1] >= self.post_seconds]
+            for track_id, violation_time in due:
+                self.pending.remove((track_id, violation_time))
+                self.write_clip(track_id, violation_time)
+
+    def write_clip(self, track_id, violation_time):
+        """Hand the buffered frames around a violation to the writer thread, with the lock held"""
+        start, end = violation_time - self.pre_seconds, violation_time + self.post_seconds
+        frames = [(timestamp, encoded) for timestamp, encoded in self.frames if start <= timestamp <= end]
+        if len(frames) < 2:
+            logging.warning(f"Not enough buffered frames for a clip of vehicle {track_id}")
+            return
+        future = self.pool.submit(self.write, track_id, violation_time, frames)
+        with self.writes_lock:
+            self.writes.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        with self.writes_lock:
+            self.writes.discard(future)
+
+    def write(self, track_id, violation_time, frames):
+        try:
+            path = self.encode_clip(track_id, frames)
+        except Exception as e:
+            logging.error(f"Error writing clip of vehicle {track_id}: {str(e)}")
+            return
+
+        self.clips_written += 1
+        if self.events is not None:
+            self.events.emit('clip', track_id=track_id, path=path, violation_time=violation_time,
+                             start_time=frames[0][0], end_time=frames[-1][0], frames=len(frames))
+        logging.info(f"Saved {frames[-1][0] - frames[0][0]:.1f}s clip of vehicle {track_id} to {path}")
+
+    def encode_clip(self, track_id, frames):
+        # Play the clip back at the rate the frames were buffered at
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else FPS
+
+        first = cv2.imdecode(frames[0][1], cv2.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        path = os.path.join(self.output_dir, clip_name(self.run, track_id))
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        try:
+            out.write(first)
+            for _, encoded in frames[1:]:
+                out.write(cv2.imdecode(encoded, cv2.IMREAD_COLOR))
+        finally:
+            out.release()
+        return path
+
+    def drain(self):
+        """Wait for the clips handed to the writer so far to be written and logged.
+
+        The caller holds the lock, so no clip is handed over until it has also
+        taken the pending clips and the event log offset for a checkpoint.
+        """
+        with self.writes_lock:
+            writes = list(self.writes)
+        wait(writes)
+        if self.events is not None:
+            self.events.flush()
+
+    def close(self):
+        """Write the clips still waiting for later frames and wait for the writer"""
+        with self.lock:
+            for track_id, violation_time in self.pending:
+                self.write_clip(track_id, violation_time)
+            self.pending = []
+        self.pool.shutdown(wait=True)
+        if self.events is not None:
+            self.events.flush()
+        logging.info(f"Clip buffer dropped {self.dropped_frames} frames over its "
+                     f"{self.budget_bytes / (1024 * 1024):.0f} MB budget, {self.clips_written} clips saved")
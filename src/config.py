@@ -10,8 +10,32 @@ SPEED_LIMIT = 80  # km/h
 MIN_SPEED_FOR_CHALLAN = 80
 MAX_SPEED_FOR_CHALLAN = 120
 PIXELS_PER_METER = 10
+SPEED_FACTOR = 2.0  # Empirical correction of PIXELS_PER_METER speeds, tune with calibration_sweep.py
+SPEED_SMOOTHING_WINDOW = 10  # Speed samples in the moving average
 FPS = 30
+SPEED_MODE = "path"  # "path" measures along the track history, "trap" times vehicles between TRAP_LINES
+TRAP_LINES = [[[100, 450], [750, 450]], [[25, 550], [775, 550]]]  # Two lines [[x1, y1], [x2, y2]] across the ROI
+TRAP_DISTANCE_METERS = 10.0  # Road distance between the trap lines, measured on the ground plane when calibrated
+SPEED_FILTER = "kalman"  # "kalman" filters path speeds over the track positions, "mean" averages SPEED_SMOOTHING_WINDOW samples
+KALMAN_ACCEL_NOISE = 3.0  # m/s^2, how quickly a vehicle's speed may change
+KALMAN_MEASUREMENT_NOISE = 0.5  # m, position noise of a track point
+SPEED_CONFIDENCE_Z = 1.645  # Kalman violations need speed - Z * std above the limit (1.645 = 95% one-sided)
 ROI_POINTS = [[100, 400], [700, 400], [800, 600], [0, 600]]  # Region of Interest
+ROI_INFERENCE = True  # Detect only inside the ROI and drop tracks outside it
+
+# Ground Plane Calibration
+# Four or more image pixels [x, y] and their positions [X, Y] in meters on the road.
+# When set, speeds are measured on the ground plane instead of with PIXELS_PER_METER.
+HOMOGRAPHY_IMAGE_POINTS = None
+HOMOGRAPHY_GROUND_POINTS = None
+
+# High-Resolution Cameras
+# Frames wider than DETECTION_WIDTH are downscaled for detection and optical flow;
+# evidence crops still come from the full-resolution frame.
+DETECTION_WIDTH = None  # e.g. 1280 for 4K cameras
+FAR_FIELD_REGION = None  # [x1, y1, x2, y2] in full-resolution pixels, detected in full-resolution tiles
+TILE_SIZE = 640
+TILE_OVERLAP = 64  # pixels shared by neighbouring tiles
 
 # Detection Thresholds
 VEHICLE_CONFIDENCE = 0.5
@@ -23,6 +47,81 @@ FRAME_SKIP = 5  # Process every Nth frame
 MAX_SCREENSHOTS_PER_VEHICLE = 3
 SPEED_HISTORY_LENGTH = 100
 TRACK_HISTORY_LENGTH = 30
+TRACK_TIMEOUT_FRAMES = 60  # Finalize tracks missed in this many detection frames
+PIPELINE_QUEUE_SIZE = 8  # Frames buffered between pipeline stages
+PIPELINE_REPORT_INTERVAL = 5.0  # Seconds between stage FPS reports
+HEADLESS = False  # Skip visualization (also enabled with --headless)
+MOTION_GATE = True  # Skip inference when nothing moves inside the ROI
+MOTION_THRESHOLD = 25  # Grayscale difference counted as motion
+MOTION_MIN_AREA = 0.002  # Fraction of ROI pixels that must change
+MOTION_GATE_MAX_SKIP = 30  # Force inference after this many skipped frames
+DETECTOR_INTERVAL = 1  # Run the detector every Nth processed frame, optical flow in between
+FLOW_GRID_SIZE = 3  # Flow points per box side
+FLOW_BOX_SCALE = 0.5  # Fraction of the box covered by the flow point grid
+FLOW_MAX_FB_ERROR = 1.0  # Max forward-backward flow error in pixels
+FLOW_MIN_POINTS = 3  # Points a track needs to be carried forward
+FLOW_MAX_LOST_FRACTION = 0.3  # Force a detector refresh when more tracks are lost
+PLATE_BATCH_SIZE = 16  # Vehicle crops per plate inference call, exported backends take one at a time
+
+# Evidence
+EVIDENCE_WRITER_WORKERS = 2  # Threads writing evidence crops
+EVIDENCE_BEST_K = MAX_SCREENSHOTS_PER_VEHICLE  # Sharpest, largest views kept per speeding vehicle
+EVIDENCE_CONTEXT_SCALE = 0.25  # Scale of the context frame saved with each crop, None to skip it
+
+# Violation Clips
+CLIP_BUFFER_MB = 64  # Hard memory budget of the encoded frame ring buffer, 0 disables clips
+CLIP_PRE_SECONDS = 2.0  # Seconds of video before the violation in each clip
+CLIP_POST_SECONDS = 1.0  # Seconds of video after the violation in each clip
+CLIP_JPEG_QUALITY = 80
+
+# Replay Cache
+RECORDING_PATH = os.path.join(OUTPUT_DIR, "detections", "tracker_output.npz")
+REPLAY_OUTPUT_DIR = os.path.join(OUTPUT_DIR, "replay")
+
+# Calibration Sweep
+GROUND_TRUTH_CSV = "ground_truth.csv"  # Reference speeds, e.g. radar logs
+SWEEP_WORKERS = None  # Worker processes, defaults to the number of cores
+SWEEP_MATCH_TOLERANCE = 1.0  # Seconds a timestamped reading may fall outside a track
+
+# Load Shedding
+LOAD_CONTROL = False  # Adapt inference size and detector interval to LOAD_TARGET_MS (also --load-control)
+LOAD_TARGET_MS = 100  # Per-frame tracking time budget
+LOAD_CONTROL_WINDOW = 30  # Frames averaged before each adjustment
+LOAD_RECOVER_RATIO = 0.6  # Restore quality once below this fraction of the budget
+INFERENCE_IMGSZ_LEVELS = [640, 512, 416, 320]  # Inference sizes the controller steps through, best first
+DETECTOR_INTERVAL_MAX = 6  # Longest detector keyframe interval the controller may use
+
+# Live Streams
+LIVE_SOURCE = "rtsp://127.0.0.1:8554/stream"  # RTSP or HTTP MJPEG URL, or named pipe, for --live
+LIVE_LATENCY_BUDGET = 0.5  # Seconds a frame may age between capture and tracking before it is dropped
+LIVE_RECONNECT_SECONDS = 2.0  # Wait before reopening a network stream that stopped delivering
+LIVE_LATENCY_WINDOW = 1000  # Recent frames in the latency percentiles
+
+# Checkpointing
+CHECKPOINT_INTERVAL = 1800  # Processed frames between checkpoints, 0 disables them
+
+# Event Log
+EVENT_LOG_SPEED_SAMPLES = True  # Stream every speed sample, not only track and violation events
+EVENT_TAIL_IDLE_TIMEOUT = 300  # Seconds without new events before followers give up
+PLATE_WAIT_TIMEOUT = 30  # Seconds the challan follower waits for the plates of a finalized vehicle
+
+# Inference Backend
+INFERENCE_BACKEND = "pytorch"  # pytorch, onnx, onnx-int8, openvino or openvino-int8
+INFERENCE_IMGSZ = 640  # Detector input size used for export
+CALIBRATION_VIDEOS = [VIDEO_PATH]  # Clips used to calibrate INT8 models
+CALIBRATION_FRAMES = 200
+BENCHMARK_FRAMES = 100
+
+# Multi-Camera Processing
+CAMERAS_CONFIG = "cameras.json"  # Camera list for src/multi_camera.py
+CAMERA_WORKERS = None  # Worker processes, defaults to the CPU count
+TORCH_THREADS_PER_WORKER = None  # Defaults to CPU count / workers
+
+# Segmented Processing
+SEGMENT_WORKERS = None  # Worker processes for src/segmented_run.py, defaults to the CPU count
+SEGMENT_SECONDS = None  # Length of each segment, None splits the video evenly over the workers
+SEGMENT_OVERLAP_SECONDS = 5.0  # Video tracked by both segments at a boundary, to warm up and stitch tracks
+SEGMENT_STITCH_DISTANCE = 30  # Max mean pixel distance of the same vehicle's boxes in the overlap
 
 # Challan System
 BASE_SPEED_LIMIT = 80  # km/h
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+
+class EventLog:
+    """Append-only JSONL stream of detection events.
+
+    Records are written as they happen and flushed once per frame, so the
+    plate and challan stages can tail the file while detection is running and
+    a crash loses at most the events of the frame in progress.
+    """
+
+    def __init__(self, path, offset=None):
+        self.path = path
+        self.lock = threading.Lock()
+        if offset is None:
+            self.file = open(path, 'w')
+        else:
+            # Continue an earlier log, dropping everything written after offset
+            with open(path, 'a') as f:
+                f.truncate(offset)
+            self.file = open(path, 'a')
+
+    def emit(self, event, **fields):
+        """Append one event record"""
+        record = {'event': event, 'time': time.time()}
+        record.update(fields)
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def tell(self):
+        """Size of the log in bytes once everything emitted so far is written"""
+        with self.lock:
+            self.file.flush()
+            return self.file.tell()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+def read_events(path, event=None):
+    """Read every complete record of an event log, optionally of one event type"""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            # A line without a newline is still being written
+            if not line.endswith('\n'):
+                break
+            record = json.loads(line)
+            if event is None or record['event'] == event:
+                records.append(record)
+    return records
+
+def tail_events(path, poll_interval=0.5, idle_timeout=None):
+    """Yield events as they are appended to the log until the run ends.
+
+    Stops after the 'run_end' event, or when nothing new has been written
+    for idle_timeout seconds, e.g. because the detector crashed.
+    """
+    idle_since = time.time()
+    while not os.path.exists(path):
+        if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+            return
+        time.sleep(poll_interval)
+
+    with open(path, 'r') as f:
+        partial = ''
+        while True:
+            line = f.readline()
+            if not line:
+                if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            idle_since = time.time()
+            partial += line
+            if not partial.endswith('\n'):
+                continue
+
+            record = json.loads(partial)
+            partial = ''
+            yield record
+            if record['event'] == 'run_end':
+                return
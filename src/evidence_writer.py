@@ -0,0 +1,138 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import cv2
+from config import *
+
+def box_bounds(box, frame_shape):
+    """Pixel bounds [x1, y1, x2, y2] of an xywh box, clipped to the frame"""
+    frame_h, frame_w = frame_shape[:2]
+    x, y, w, h = box
+    return [max(int(x - w / 2), 0), max(int(y - h / 2), 0),
+            min(int(x + w / 2), frame_w), min(int(y + h / 2), frame_h)]
+
+def evidence_stem(track_id, frame, speed):
+    """File name stem of an evidence crop, unique per frame so the views of a track never overwrite each other"""
+    # The plate readers take the vehicle ID from the second and the speed from the last field
+    return f"vehicle_{track_id}_{frame}_{speed:.1f}kmh"
+
+class EvidenceWriter:
+    """Writes evidence of speeding vehicles on a thread pool.
+
+    Each piece of evidence is a tight, unannotated crop of the vehicle box
+    with a JSON sidecar holding the box in frame coordinates, and optionally
+    a downscaled copy of the whole frame for context. The plate readers only
+    have to load and search the crop.
+    """
+
+    def __init__(self, output_dir, events=None, workers=EVIDENCE_WRITER_WORKERS,
+                 context_scale=EVIDENCE_CONTEXT_SCALE):
+        self.output_dir = output_dir
+        self.context_dir = os.path.join(output_dir, 'context')
+        self.events = events
+        self.context_scale = context_scale
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='evidence')
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.files_written = 0
+        self.bytes_written = 0
+
+        # Context frames get their own directory so the crops are all that is in output_dir
+        if self.context_scale:
+            os.makedirs(self.context_dir, exist_ok=True)
+
+    def capture(self, frame, bbox):
+        """Copy the crop of bbox and the downscaled context out of a frame"""
+        x1, y1, x2, y2 = bbox
+        context = None
+        if self.context_scale:
+            context = cv2.resize(frame, None, fx=self.context_scale, fy=self.context_scale,
+                                 interpolation=cv2.INTER_AREA)
+        return {
+            'crop': frame[y1:y2, x1:x2].copy(),
+            'bbox': list(bbox),
+            'frame_size': [frame.shape[1], frame.shape[0]],
+            'context': context
+        }
+
+    def submit(self, evidence, event=None, **fields):
+        """Queue the captured evidence of one vehicle, each with its track_id, speed, frame, score and path.
+
+        With an event, it is logged with the fields once all of the evidence
+        is written, so followers of the log find the files on disk.
+        """
+        future = self.pool.submit(self.write_all, evidence, event, fields)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            logging.error(f"Error writing evidence: {str(future.exception())}")
+
+    def write_all(self, evidence, event, fields):
+        for item in evidence:
+            try:
+                self.write(item)
+            except Exception as e:
+                logging.error(f"Error writing evidence of vehicle {item['track_id']}: {str(e)}")
+        if event is not None and self.events is not None:
+            self.events.emit(event, **fields)
+
+    def write(self, evidence):
+        """Write the crop, sidecar and context frame of one view of a vehicle"""
+        if evidence['crop'].size == 0:
+            logging.warning(f"Empty evidence crop for vehicle {evidence['track_id']}")
+            return
+
+        path = evidence['path']
+        stem = os.path.splitext(os.path.basename(path))[0]
+        cv2.imwrite(path, evidence['crop'])
+        paths = [path]
+
+        context_path = None
+        if evidence['context'] is not None:
+            context_path = os.path.join(self.context_dir, f"{stem}_context.jpg")
+            cv2.imwrite(context_path, evidence['context'])
+            paths.append(context_path)
+
+        sidecar = {
+            'track_id': evidence['track_id'],
+            'speed': evidence['speed'],
+            'frame': evidence['frame'],
+            'score': evidence['score'],
+            'bbox': evidence['bbox'],
+            'frame_size': evidence['frame_size'],
+            'context_path': context_path,
+            'context_scale': self.context_scale
+        }
+        sidecar_path = os.path.join(os.path.dirname(path), f"{stem}.json")
+        with open(sidecar_path, 'w') as f:
+            json.dump(sidecar, f, indent=4)
+        paths.append(sidecar_path)
+
+        with self.lock:
+            self.files_written += len(paths)
+            self.bytes_written += sum(os.path.getsize(p) for p in paths)
+
+        if self.events is not None:
+            self.events.emit('evidence', path=path, **sidecar)
+
+    def drain(self):
+        """Wait for every queued piece of evidence to be written"""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        if self.events is not None:
+            self.events.flush()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        if self.events is not None:
+            self.events.flush()
+        logging.info(f"Evidence writer saved {self.files_written} files "
+                     f"({self.bytes_written / 1e6:.1f} MB)")
@@ -0,0 +1,41 @@
+import logging
+import numpy as np
+import cv2
+
+class GroundPlane:
+    """Mapping from image pixels to metres on the road, fitted as a homography.
+
+    The homography is fitted once to four or more image points with known
+    ground positions. Every pixel of the frame is then projected into a
+    lookup table, so mapping a track point to metres is an array index
+    instead of a matrix product and a division per point.
+    """
+
+    def __init__(self, image_points, ground_points, frame_shape):
+        image_points = np.asarray(image_points, np.float32).reshape(-1, 2)
+        ground_points = np.asarray(ground_points, np.float32).reshape(-1, 2)
+        if len(image_points) < 4 or len(image_points) != len(ground_points):
+            raise ValueError("Homography calibration needs four or more image points, "
+                             "each with a matching ground point")
+
+        self.homography, _ = cv2.findHomography(image_points, ground_points, 0)
+        if self.homography is None:
+            raise ValueError("Could not fit a homography to the calibration points, "
+                             "make sure no three of them are collinear")
+
+        # Ground position of every pixel, rows x cols x (X, Y) in metres
+        self.height, self.width = frame_shape[:2]
+        cols, rows = np.meshgrid(np.arange(self.width, dtype=np.float32),
+                                 np.arange(self.height, dtype=np.float32))
+        pixels = np.stack([cols, rows], axis=-1).reshape(-1, 1, 2)
+        self.lut = cv2.perspectiveTransform(pixels, self.homography).reshape(self.height, self.width, 2)
+
+        error = np.linalg.norm(self.to_ground(image_points) - ground_points, axis=1)
+        logging.info(f"Ground plane calibrated from {len(image_points)} points, "
+                     f"mean reprojection error {error.mean():.2f} m")
+
+    def to_ground(self, points):
+        """Ground positions in metres of (x, y) pixel points, one lookup each"""
+        cols = np.clip(np.rint(points[:, 0]).astype(np.int64), 0, self.width - 1)
+        rows = np.clip(np.rint(points[:, 1]).astype(np.int64), 0, self.height - 1)
+        return self.lut[rows, cols]
@@ -34,6 +34,15 @@ class ImprovedPlateDetector:
         # Create directory for improved detections
         os.makedirs(os.path.join('outputs', 'improved_plates'), exist_ok=True)
         
+    def evidence_rank(self, image_path):
+        """Rank an evidence image by the sharpness score in its sidecar, then by speed"""
+        speed = float(image_path.split('_')[-1].replace('kmh.jpg', ''))
+        sidecar_path = os.path.splitext(image_path)[0] + '.json'
+        if os.path.exists(sidecar_path):
+            with open(sidecar_path, 'r') as f:
+                return (json.load(f).get('score', 0), speed)
+        return (0, speed)
+        
     def detect_plates_from_speeding_images(self, speed_data_path):
         """
         Process all speeding vehicle images and detect license plates
@@ -53,7 +62,8 @@ class ImprovedPlateDetector:
         
         # Identify speeding vehicles
         for vehicle_id, data in speed_data['vehicle_speeds'].items():
-            if data['average_speed'] >= 80:  # Same threshold as in the original system
+            # Same threshold as in the original system, for vehicles the detector flagged
+            if data['average_speed'] >= 80 and data.get('violation', True):
                 speeding_vehicle_ids.append(vehicle_id)
         
         # Process each speeding vehicle's images
@@ -72,8 +82,8 @@ class ImprovedPlateDetector:
                 logging.warning(f"No images found for vehicle {vehicle_id}")
                 continue
             
-            # Use the vehicle image with the highest speed (should be in the filename)
-            vehicle_images.sort(key=lambda x: float(x.split('_')[-1].replace('kmh.jpg', '')), reverse=True)
+            # Use the sharpest, largest crop, ranked by the score in its sidecar
+            vehicle_images.sort(key=self.evidence_rank, reverse=True)
             best_image_path = vehicle_images[0]
             
             # Process the image with Fast-ALPR
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import logging
+import argparse
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from config import *
+
+# Backends that can run the YOLOv8 vehicle detector
+BACKENDS = ('pytorch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+
+def exported_path(weights, backend):
+    """Path of the exported model for a backend, next to the PyTorch weights"""
+    stem = os.path.splitext(weights)[0]
+    if backend == 'pytorch':
+        return weights
+    if backend == 'onnx':
+        return f"{stem}.onnx"
+    if backend == 'onnx-int8':
+        return f"{stem}_int8.onnx"
+    if backend == 'openvino':
+        return f"{stem}_openvino_model"
+    if backend == 'openvino-int8':
+        return f"{stem}_int8_openvino_model"
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+
+def letterbox_transform(shape, imgsz=INFERENCE_IMGSZ):
+    """Scale and (left, top) padding that letterbox() applies to an image of the given shape"""
+    h, w = shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    left = (imgsz - round(w * scale)) // 2
+    top = (imgsz - round(h * scale)) // 2
+    return scale, left, top
+
+def letterbox(frame, imgsz=INFERENCE_IMGSZ):
+    """Resize keeping the aspect ratio and pad to a square, as YOLOv8 preprocessing does"""
+    h, w = frame.shape[:2]
+    scale, left, top = letterbox_transform(frame.shape, imgsz)
+    resized = cv2.resize(frame, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_LINEAR)
+    padded = np.full((imgsz, imgsz, 3), 114, np.uint8)
+    padded[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return padded
+
+def sample_calibration_frames(video_paths, count=CALIBRATION_FRAMES):
+    """Sample frames evenly spread over our own clips for INT8 calibration"""
+    per_video = max(1, count // max(len(video_paths), 1))
+    frames = []
+    for video_path in video_paths:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logging.warning(f"Could not open calibration video {video_path}")
+            continue
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in np.linspace(0, max(total - 1, 0), per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        cap.release()
+    if not frames:
+        raise ValueError("No calibration frames could be read")
+    logging.info(f"Sampled {len(frames)} calibration frames from {len(video_paths)} video(s)")
+    return frames
+
+def quantize_onnx(fp32_path, int8_path, frames, imgsz=INFERENCE_IMGSZ):
+    """Statically quantize an ONNX model to INT8, calibrated on the given frames"""
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            if frame is None:
+                return None
+            image = cv2.cvtColor(letterbox(frame, imgsz), cv2.COLOR_BGR2RGB)
+            return {input_name: (image.transpose(2, 0, 1)[None] / 255.0).astype(np.float32)}
+
+    quantize_static(fp32_path, int8_path, FrameReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True)
+    return int8_path
+
+def write_calibration_dataset(frames, weights):
+    """Write calibration frames as an ultralytics dataset for OpenVINO INT8 export"""
+    dataset_dir = os.path.join(OUTPUT_DIR, 'calibration')
+    images_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(images_dir, f"calib_{i:04d}.jpg"), frame)
+
+    names = YOLO(weights).names
+    yaml_path = os.path.join(dataset_dir, 'calibration.yaml')
+    with open(yaml_path, 'w') as f:
+        f.write(f"path: {os.path.abspath(dataset_dir)}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in names.items():
+            f.write(f"  {class_id}: {name}\n")
+    return yaml_path
+
+def export_model(weights=MODEL_PATH, backend=INFERENCE_BACKEND, calibration_videos=None, imgsz=INFERENCE_IMGSZ):
+    """Export the PyTorch weights for a backend, calibrating INT8 models on our clips"""
+    target = exported_path(weights, backend)
+    if backend == 'pytorch':
+        return target
+
+    calibration_videos = calibration_videos or CALIBRATION_VIDEOS
+    model = YOLO(weights)
+    if backend == 'onnx':
+        exported = model.export(format='onnx', imgsz=imgsz)
+    elif backend == 'onnx-int8':
+        fp32_path = export_model(weights, 'onnx', imgsz=imgsz)
+        frames = sample_calibration_frames(calibration_videos)
+        exported = quantize_onnx(fp32_path, target, frames, imgsz)
+    elif backend == 'openvino':
+        exported = model.export(format='openvino', imgsz=imgsz)
+    else:
+        frames = sample_calibration_frames(calibration_videos)
+        exported = model.export(format='openvino', imgsz=imgsz, int8=True,
+                                data=write_calibration_dataset(frames, weights))
+
+    # Keep the exported model where load_model() looks for it
+    exported = str(exported)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        os.replace(exported, target)
+    logging.info(f"Exported {weights} for the {backend} backend to {target}")
+    return target
+
+def load_model(weights=MODEL_PATH, backend=INFERENCE_BACKEND):
+    """Load the detector for the configured backend, exporting it on first use"""
+    path = exported_path(weights, backend)
+    if not os.path.exists(path):
+        path = export_model(weights, backend)
+    logging.info(f"Loading {path} with the {backend} backend")
+    return YOLO(path, task='detect')
+
+def benchmark(backends, video_path, frames=BENCHMARK_FRAMES, weights=MODEL_PATH, imgsz=INFERENCE_IMGSZ):
+    """Measure per-frame detection latency of each backend on CPU over the same frames"""
+    cap = cv2.VideoCapture(video_path)
+    samples = []
+    while len(samples) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        samples.append(frame)
+    cap.release()
+    if not samples:
+        raise ValueError(f"Could not read frames from {video_path}")
+
+    results = {}
+    for backend in backends:
+        model = load_model(weights, backend)
+        # Warm up before timing
+        for frame in samples[:5]:
+            model.predict(frame, imgsz=imgsz, device='cpu', verbose=False)
+
+        latencies = []
+        for frame in samples:
+            start = time.perf_counter()
+            model.predict(frame, imgsz=imgsz, device='cpu', verbose=False)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        latencies = np.array(latencies)
+        results[backend] = {
+            'frames': len(latencies),
+            'mean_ms': round(float(latencies.mean()), 2),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'fps': round(1000.0 / float(latencies.mean()), 1)
+        }
+        logging.info(f"{backend}: {results[backend]['mean_ms']} ms/frame mean, "
+                     f"{results[backend]['p95_ms']} ms p95, {results[backend]['fps']} fps")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Inference Backend Export and Benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export the detector for a backend')
+    export_parser.add_argument('--backend', choices=BACKENDS, default=INFERENCE_BACKEND)
+    export_parser.add_argument('--weights', type=str, default=MODEL_PATH)
+    export_parser.add_argument('--calibration-videos', nargs='+', help='Clips to calibrate INT8 models on')
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Compare backend latency on CPU')
+    benchmark_parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    benchmark_parser.add_argument('--weights', type=str, default=MODEL_PATH)
+    benchmark_parser.add_argument('--video', type=str, default=VIDEO_PATH)
+    benchmark_parser.add_argument('--frames', type=int, default=BENCHMARK_FRAMES)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_model(args.weights, args.backend, args.calibration_videos)
+    else:
+        results = benchmark(args.backends, args.video, args.frames, args.weights)
+        results_path = os.path.join(OUTPUT_DIR, 'detections', 'backend_benchmark.json')
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=4)
+        logging.info(f"Benchmark results saved to {results_path}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -1,6 +1,5 @@
 import cv2
 import torch
-from ultralytics import YOLO
 import os
 from datetime import datetime
 import numpy as np
@@ -10,6 +9,9 @@ import logging
 import easyocr
 from config import *
 from plate_database import get_plate_number
+from inference_backend import load_model, letterbox, letterbox_transform
+from pipeline import Pipeline
+from event_log import tail_events
 
 # Configure logging
 logging.basicConfig(
@@ -21,9 +23,33 @@ logging.basicConfig(
     ]
 )
 
+def detect_plates(model, portions, batch_size=None):
+    """Detect license plates in the lower portions of one frame's vehicles.
+    
+    Every portion is letterboxed to the same square, so up to batch_size of
+    them run through the detector in a single call. Returns the plate boxes
+    (x1, y1, x2, y2) in the pixels of each portion with their confidences.
+    """
+    if batch_size is None:
+        batch_size = PLATE_BATCH_SIZE if INFERENCE_BACKEND == 'pytorch' else 1
+    images = [letterbox(portion) for portion in portions]
+    results = []
+    for start in range(0, len(images), batch_size):
+        results += model(images[start:start + batch_size], imgsz=INFERENCE_IMGSZ, verbose=False)
+    
+    plates = []
+    for portion, result in zip(portions, results):
+        # Map the boxes from the letterboxed square back to the portion
+        scale, left, top = letterbox_transform(portion.shape)
+        boxes = result.boxes.xyxy.cpu().numpy().copy()
+        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - left) / scale, 0, portion.shape[1])
+        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - top) / scale, 0, portion.shape[0])
+        plates.append((boxes, result.boxes.conf.cpu().numpy()))
+    return plates
+
 def detect_license_plates(video_path):
-    # Initialize YOLOv8 model
-    model = YOLO('yolov8n.pt')
+    # Initialize YOLOv8 model with the configured inference backend
+    model = load_model(MODEL_PATH, INFERENCE_BACKEND)
     
     # Create output directories
     os.makedirs("outputs/cars", exist_ok=True)
@@ -49,25 +75,32 @@ def detect_license_plates(video_path):
     last_detection_time = 0
     detection_interval = 1.0  # Minimum time between detections
     
-    while cap.isOpened():
+    def decode():
+        nonlocal frame_count
         ret, frame = cap.read()
         if not ret:
-            break
-            
+            return None
         frame_count += 1
+        return {'frame': frame, 'frame_count': frame_count, 'plates': []}
+    
+    def detect(item):
+        nonlocal last_detection_time
+        frame = item['frame']
         current_time = datetime.now().timestamp()
         
         # Process every 5th frame to reduce load
-        if frame_count % 5 == 0 and (current_time - last_detection_time) > detection_interval:
+        if item['frame_count'] % 5 == 0 and (current_time - last_detection_time) > detection_interval:
             # Detect vehicles
             results = model(frame)
             
+            # Collect the vehicles first, their plates are detected in one batch
+            vehicles = []
             for result in results:
                 boxes = result.boxes.xyxy.cpu().numpy()
                 scores = result.boxes.conf.cpu().numpy()
                 class_ids = result.boxes.cls.cpu().numpy()
                 
-                for i, (box, score, class_id) in enumerate(zip(boxes, scores, class_ids)):
+                for box, score, class_id in zip(boxes, scores, class_ids):
                     if score > 0.5 and class_id in [2, 3, 5, 7]:  # Vehicle classes
                         x1, y1, x2, y2 = map(int, box)
                         
@@ -75,57 +108,72 @@ def detect_license_plates(video_path):
                         vehicle_region = frame[y1:y2, x1:x2]
                         if vehicle_region.size == 0:
                             continue
-                            
+                        
                         # Focus on lower portion for plate detection
-                        vh, vw = vehicle_region.shape[:2]
-                        lower_portion = vehicle_region[int(vh*0.7):, :]
+                        offset = int(vehicle_region.shape[0] * 0.7)
+                        vehicles.append(((x1, y1, x2, y2), offset, vehicle_region[offset:, :]))
+            
+            # Detect license plates in all lower portions at once
+            plates = detect_plates(model, [portion for _, _, portion in vehicles]) if vehicles else []
+            
+            for ((x1, y1, x2, y2), offset, lower_portion), (plate_boxes, plate_scores) in zip(vehicles, plates):
+                for plate_box, plate_score in zip(plate_boxes, plate_scores):
+                    if plate_score > 0.3:  # Plate confidence threshold
+                        px1, py1, px2, py2 = map(int, plate_box)
                         
-                        # Detect license plate in lower portion
-                        plate_results = model(lower_portion)
+                        # Draw detection boxes
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                        cv2.rectangle(frame,
+                                    (x1 + px1, y1 + py1 + offset),
+                                    (x1 + px2, y1 + py2 + offset),
+                                    (255, 0, 0), 2)
                         
-                        for plate_result in plate_results:
-                            plate_boxes = plate_result.boxes.xyxy.cpu().numpy()
-                            plate_scores = plate_result.boxes.conf.cpu().numpy()
-                            
-                            for j, (plate_box, plate_score) in enumerate(zip(plate_boxes, plate_scores)):
-                                if plate_score > 0.3:  # Plate confidence threshold
-                                    px1, py1, px2, py2 = map(int, plate_box)
-                                    
-                                    # Draw detection boxes
-                                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                                    cv2.rectangle(frame, 
-                                                (x1 + px1, y1 + py1 + int(vh*0.7)), 
-                                                (x1 + px2, y1 + py2 + int(vh*0.7)), 
-                                                (255, 0, 0), 2)
-                                    
-                                    # Save plate image
-                                    plate_img = lower_portion[py1:py2, px1:px2]
-                                    if plate_img.size > 0:
-                                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                        plate_path = os.path.join("outputs", "plates", 
-                                                                f"plate_{timestamp}_{frame_count}.jpg")
-                                        cv2.imwrite(plate_path, plate_img)
-                                        print(f"License plate detected and saved: {plate_path}")
+                        # Queue plate image for the writer stage
+                        plate_img = lower_portion[py1:py2, px1:px2]
+                        if plate_img.size > 0:
+                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                            plate_path = os.path.join("outputs", "plates",
+                                                    f"plate_{timestamp}_{item['frame_count']}.jpg")
+                            item['plates'].append((plate_path, plate_img.copy()))
         
         last_detection_time = current_time
-        
-        # Write frame to output video
-        out.write(frame)
-        
-        # Display frame
-        cv2.imshow('License Plate Detection', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        return item
+    
+    def write(item):
+        # Plate images and the output video are encoded off the detection thread
+        for plate_path, plate_img in item['plates']:
+            cv2.imwrite(plate_path, plate_img)
+            print(f"License plate detected and saved: {plate_path}")
+        out.write(item['frame'])
+        return item
+    
+    # Decode, detection and writing each run on their own thread
+    pipeline = Pipeline(PIPELINE_QUEUE_SIZE, PIPELINE_REPORT_INTERVAL)
+    pipeline.add_source("decode", decode)
+    pipeline.add_stage("detect", detect)
+    pipeline.add_stage("write", write)
     
-    # Release resources
-    cap.release()
-    out.release()
-    cv2.destroyAllWindows()
+    try:
+        pipeline.start()
+        for item in pipeline.results("display"):
+            # Display frame
+            cv2.imshow('License Plate Detection', item['frame'])
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    
+    finally:
+        # Release resources once every stage has exited
+        pipeline.stop()
+        pipeline.join()
+        pipeline.log_report("display")
+        cap.release()
+        out.release()
+        cv2.destroyAllWindows()
 
 class LicensePlateDetector:
     def __init__(self):
         # Initialize YOLOv8 model for vehicle and plate detection
-        self.model = YOLO('yolov8n.pt')
+        self.model = load_model(MODEL_PATH, INFERENCE_BACKEND)
         
         # Initialize OCR reader
         self.reader = easyocr.Reader(['en'])
@@ -138,7 +186,8 @@ class LicensePlateDetector:
         self.detection_results = {
             'total_vehicles_processed': 0,
             'plates_detected': 0,
-            'vehicle_details': {}
+            'vehicle_details': {},
+            'finalized_vehicles': []  # vehicles whose every evidence image has been read
         }
     
     def preprocess_plate(self, plate_img):
@@ -207,6 +256,35 @@ class LicensePlateDetector:
             }
         return None
     
+    def record_plate(self, image_path):
+        """Detect the plate in one evidence image and add it to the detection results"""
+        # Detect plate
+        plate_data = self.detect_plate(image_path)
+        
+        if plate_data:
+            vehicle_id = plate_data['vehicle_id']
+            
+            # Update detection results
+            if vehicle_id not in self.detection_results['vehicle_details']:
+                self.detection_results['vehicle_details'][vehicle_id] = []
+            
+            self.detection_results['vehicle_details'][vehicle_id].append({
+                'plate_text': plate_data['plate_text'],
+                'plate_path': plate_data['plate_path'],
+                'confidence': plate_data['confidence']
+            })
+            
+            self.detection_results['plates_detected'] += 1
+            logging.info(f"Plate detected for vehicle {vehicle_id}: {plate_data['plate_text']}")
+        
+        self.detection_results['total_vehicles_processed'] += 1
+    
+    def save_results(self):
+        """Save the plate detection results"""
+        results_path = os.path.join(OUTPUT_DIR, 'plates', 'plate_detection_results.json')
+        with open(results_path, 'w') as f:
+            json.dump(self.detection_results, f, indent=4)
+    
     def process_speeding_vehicles(self):
         """Process all images in the speeding directory"""
         speeding_dir = os.path.join(OUTPUT_DIR, 'speeding')
@@ -215,43 +293,59 @@ class LicensePlateDetector:
         image_files = [f for f in os.listdir(speeding_dir) if f.endswith('.jpg')]
         
         for image_file in image_files:
-            image_path = os.path.join(speeding_dir, image_file)
-            
-            # Detect plate
-            plate_data = self.detect_plate(image_path)
-            
-            if plate_data:
-                vehicle_id = plate_data['vehicle_id']
-                
-                # Update detection results
-                if vehicle_id not in self.detection_results['vehicle_details']:
-                    self.detection_results['vehicle_details'][vehicle_id] = []
-                
-                self.detection_results['vehicle_details'][vehicle_id].append({
-                    'plate_text': plate_data['plate_text'],
-                    'plate_path': plate_data['plate_path'],
-                    'confidence': plate_data['confidence']
-                })
-                
-                self.detection_results['plates_detected'] += 1
-                logging.info(f"Plate detected for vehicle {vehicle_id}: {plate_data['plate_text']}")
-            
-            self.detection_results['total_vehicles_processed'] += 1
+            self.record_plate(os.path.join(speeding_dir, image_file))
         
         # Save detection results
-        results_path = os.path.join(OUTPUT_DIR, 'plates', 'plate_detection_results.json')
-        with open(results_path, 'w') as f:
-            json.dump(self.detection_results, f, indent=4)
+        self.save_results()
+        
+        logging.info(f"Plate detection completed. Processed {self.detection_results['total_vehicles_processed']} vehicles, "
+                    f"detected {self.detection_results['plates_detected']} plates.")
+    
+    def process_event_stream(self, events_path):
+        """Detect plates on evidence images as the speed detector saves them.
+
+        The detector finalizes a vehicle after its evidence, so once its
+        track_finalize event is reached the vehicle's plates are all read. It
+        is then listed in finalized_vehicles for the challan follower.
+        """
+        logging.info(f"Following detection events in {events_path}")
         
+        for event in tail_events(events_path, idle_timeout=EVENT_TAIL_IDLE_TIMEOUT):
+            if event['event'] == 'run_start':
+                # The detector restarted the log, start over with it
+                self.detection_results = {
+                    'total_vehicles_processed': 0,
+                    'plates_detected': 0,
+                    'vehicle_details': {},
+                    'finalized_vehicles': []
+                }
+            elif event['event'] == 'evidence':
+                self.record_plate(event['path'])
+                self.save_results()
+            elif event['event'] == 'track_finalize':
+                self.detection_results['finalized_vehicles'].append(str(event['track_id']))
+                self.save_results()
+        
+        self.save_results()
         logging.info(f"Plate detection completed. Processed {self.detection_results['total_vehicles_processed']} vehicles, "
                     f"detected {self.detection_results['plates_detected']} plates.")
 
 def main():
+    parser = argparse.ArgumentParser(description='License Plate Detection')
+    parser.add_argument('--follow', action='store_true',
+                        help='Tail the speed detection event log and process evidence while detection runs')
+    parser.add_argument('--events', type=str, default=os.path.join(OUTPUT_DIR, 'speeding', 'events.jsonl'),
+                        help='Event log written by speed detection')
+    args = parser.parse_args()
+    
     # Initialize license plate detector
     detector = LicensePlateDetector()
     
-    # Process all speeding vehicles
-    detector.process_speeding_vehicles()
+    if args.follow:
+        detector.process_event_stream(args.events)
+    else:
+        # Process all speeding vehicles
+        detector.process_speeding_vehicles()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+import time
+import logging
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from config import *
+
+class LiveSource:
+    """Latest-frame-wins reader of a live RTSP, HTTP MJPEG or named pipe stream.
+
+    A grabber thread reads the stream as fast as it delivers and keeps only
+    the newest frame, stamped with its capture time, so a slow consumer skips
+    frames instead of falling further and further behind. Frames older than
+    the latency budget by the time they are read or tracked are dropped.
+    """
+
+    def __init__(self, source, latency_budget=LIVE_LATENCY_BUDGET, reconnect_delay=LIVE_RECONNECT_SECONDS):
+        self.source = source
+        self.latency_budget = latency_budget
+        self.reconnect_delay = reconnect_delay
+        self.cap = None
+        self.thread = None
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.ended = False
+        self.latest = None  # (frame, capture timestamp, sequence number)
+        self.last_read = 0
+        self.started = None
+
+        # Metrics
+        self.captured = 0
+        self.overwritten = 0  # replaced by a newer frame before they were read
+        self.dropped_stale = 0  # past the latency budget when read or tracked
+        self.processed = 0
+        self.latencies = deque(maxlen=LIVE_LATENCY_WINDOW)
+
+    def open(self):
+        """Open the stream and start the grabber thread, False if it cannot be opened"""
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            return False
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name='live-grabber', daemon=True)
+        self.thread.start()
+        return True
+
+    def clock(self):
+        """Seconds since the stream was opened, the time base of the capture timestamps"""
+        return time.monotonic() - self.started
+
+    def grab(self):
+        """Read the next frame from the stream, or None when it stops delivering"""
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def reconnect(self):
+        """Reopen a network stream that stopped delivering, False for streams that ended"""
+        if '://' not in str(self.source):
+            return False
+        logging.warning(f"Live stream {self.source} stopped, reconnecting in {self.reconnect_delay}s")
+        self.cap.release()
+        time.sleep(self.reconnect_delay)
+        self.cap = cv2.VideoCapture(self.source)
+        return True
+
+    def run(self):
+        while not self.stopped:
+            frame = self.grab()
+            if frame is None:
+                if self.stopped or not self.reconnect():
+                    break
+                continue
+            with self.condition:
+                self.captured += 1
+                if self.latest is not None and self.latest[2] > self.last_read:
+                    self.overwritten += 1
+                self.latest = (frame, self.clock(), self.captured)
+                self.condition.notify()
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+
+    def read(self):
+        """Wait for a frame newer than the last one read and return (frame, timestamp, sequence number).
+
+        Returns None once the stream has ended or the source is closed.
+        """
+        while True:
+            with self.condition:
+                while not self.stopped and (self.latest is None or self.latest[2] <= self.last_read):
+                    if self.ended:
+                        return None
+                    self.condition.wait(0.1)
+                if self.stopped:
+                    return None
+                frame, timestamp, sequence = self.latest
+                self.last_read = sequence
+            if not self.stale(timestamp):
+                return frame, timestamp, sequence
+
+    def stale(self, timestamp):
+        """Whether a frame captured at timestamp is past the latency budget, counting it as dropped"""
+        if self.latency_budget and self.clock() - timestamp > self.latency_budget:
+            self.dropped_stale += 1
+            return True
+        return False
+
+    def record_latency(self, timestamp):
+        """Record the end-to-end latency of a frame whose results are out"""
+        self.processed += 1
+        self.latencies.append(self.clock() - timestamp)
+
+    def metrics(self):
+        """Capture, drop and end-to-end latency statistics of the stream"""
+        latencies = np.array(self.latencies) * 1000
+        dropped = self.overwritten + self.dropped_stale
+        return {
+            'captured_frames': self.captured,
+            'processed_frames': self.processed,
+            'overwritten_frames': self.overwritten,
+            'stale_frames': self.dropped_stale,
+            'drop_rate': round(dropped / self.captured, 3) if self.captured else 0.0,
+            'latency_ms_mean': round(float(latencies.mean()), 1) if len(latencies) else None,
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+            'latency_ms_max': round(float(latencies.max()), 1) if len(latencies) else None
+        }
+
+    def log_metrics(self):
+        metrics = self.metrics()
+        logging.info(f"Live stream - {metrics['captured_frames']} captured, {metrics['processed_frames']} processed, "
+                     f"drop rate {metrics['drop_rate']:.1%}, latency p50 {metrics['latency_ms_p50']} ms, "
+                     f"p95 {metrics['latency_ms_p95']} ms")
+
+    def close(self):
+        """Stop the grabber thread and release the stream"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        if self.cap is not None:
+            self.cap.release()
+
+class RealtimeFileSource(LiveSource):
+    """A video file played back at its real-time rate, standing in for a live camera.
+
+    Frames are released when their position in the video is reached on the
+    wall clock, so the detector sees the same frame drops it would on a
+    camera delivering the file's frame rate.
+    """
+
+    def grab(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec > 0:
+            due = msec / 1000.0
+        else:
+            due = (self.cap.get(cv2.CAP_PROP_POS_FRAMES) - 1) / (self.cap.get(cv2.CAP_PROP_FPS) or FPS)
+        delay = due - self.clock()
+        if delay > 0:
+            time.sleep(delay)
+        return frame
+
+    def reconnect(self):
+        return False
@@ -0,0 +1,65 @@
+import logging
+from collections import deque
+
+class LoadController:
+    """Feedback controller trading detection quality for throughput.
+
+    The tracking time of every frame is averaged over a window and compared
+    to the target budget. Over budget, the controller first lengthens the
+    detector keyframe interval, since optical flow frames are cheap, and
+    then lowers the inference size. Once the average is back well below the
+    budget it restores the inference size first, then the keyframe interval.
+    The window spans at least two keyframe intervals, so it always averages
+    detector and optical flow frames. After each step the window starts
+    over so the next decision sees its effect.
+    """
+
+    def __init__(self, target_ms, imgsz_levels, min_interval, max_interval, window=30, recover_ratio=0.6,
+                 events=None):
+        self.target = target_ms / 1000.0
+        self.imgsz_levels = list(imgsz_levels)
+        self.min_interval = max(min_interval, 1)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.recover_ratio = recover_ratio
+        self.events = events
+        self.level = 0
+        self.interval = self.min_interval
+        self.window = window
+        self.samples = deque(maxlen=max(window, 2 * self.max_interval))
+
+    @property
+    def imgsz(self):
+        return self.imgsz_levels[self.level]
+
+    def observe(self, seconds, frame=None):
+        """Add the tracking time of one frame, return True if the settings changed"""
+        self.samples.append(seconds)
+        span = max(self.window, 2 * self.interval)
+        if len(self.samples) < span:
+            return False
+
+        mean = sum(list(self.samples)[-span:]) / span
+        previous = (self.imgsz, self.interval)
+        if mean > self.target:
+            if self.interval < self.max_interval:
+                self.interval += 1
+            elif self.level < len(self.imgsz_levels) - 1:
+                self.level += 1
+        elif mean < self.target * self.recover_ratio:
+            if self.level > 0:
+                self.level -= 1
+            elif self.interval > self.min_interval:
+                self.interval -= 1
+        if (self.imgsz, self.interval) == previous:
+            return False
+
+        self.samples.clear()
+        direction = 'shedding load' if mean > self.target else 'restoring quality'
+        logging.info(f"Load control {direction}: {mean * 1000:.1f} ms per frame against {self.target * 1000:.0f} ms, "
+                     f"inference size {previous[0]} -> {self.imgsz}, "
+                     f"detector interval {previous[1]} -> {self.interval}")
+        if self.events is not None:
+            self.events.emit('load_adjust', frame=frame, frame_ms=round(mean * 1000, 1),
+                             target_ms=round(self.target * 1000, 1), imgsz=self.imgsz,
+                             detector_interval=self.interval)
+        return True
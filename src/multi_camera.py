@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import torch
+from config import *
+from speed_detection import SpeedDetector
+
+# Configure logging, replacing the handlers speed_detection set up on import
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(OUTPUT_DIR, 'multi_camera.log')),
+        logging.StreamHandler()
+    ],
+    force=True
+)
+
+def load_cameras(cameras_path):
+    """Load the camera list, falling back to a single camera on VIDEO_PATH"""
+    if cameras_path and os.path.exists(cameras_path):
+        with open(cameras_path, 'r') as f:
+            cameras = json.load(f)['cameras']
+    else:
+        logging.warning(f"Camera config {cameras_path} not found, using VIDEO_PATH")
+        cameras = [{'name': 'default', 'source': VIDEO_PATH}]
+
+    names = [camera['name'] for camera in cameras]
+    if len(set(names)) != len(names):
+        raise ValueError("Camera names must be unique, they are used as output directories")
+    return cameras
+
+def init_worker(torch_threads):
+    """Limit the threads of each worker so the pool does not oversubscribe the cores"""
+    torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(1)
+
+def run_camera(camera):
+    """Run speed detection for one camera in its own output namespace"""
+    detector = SpeedDetector(
+        roi_points=camera.get('roi_points', ROI_POINTS),
+        pixels_per_meter=camera.get('pixels_per_meter', PIXELS_PER_METER),
+        speed_limit=camera.get('speed_limit', SPEED_LIMIT),
+        output_dir=os.path.join(OUTPUT_DIR, 'cameras', camera['name']),
+        detector_interval=camera.get('detector_interval', DETECTOR_INTERVAL),
+        speed_factor=camera.get('speed_factor', SPEED_FACTOR),
+        image_points=camera.get('homography_image_points', HOMOGRAPHY_IMAGE_POINTS),
+        ground_points=camera.get('homography_ground_points', HOMOGRAPHY_GROUND_POINTS),
+        speed_mode=camera.get('speed_mode', SPEED_MODE),
+        trap_lines=camera.get('trap_lines', TRAP_LINES),
+        trap_distance=camera.get('trap_distance', TRAP_DISTANCE_METERS),
+        speed_filter=camera.get('speed_filter', SPEED_FILTER),
+        detection_width=camera.get('detection_width', DETECTION_WIDTH),
+        far_field_region=camera.get('far_field_region', FAR_FIELD_REGION)
+    )
+    report = detector.process_video(camera['source'], headless=True,
+                                    frame_skip=camera.get('frame_skip', FRAME_SKIP))
+    if report is None:
+        report = {'video_path': camera['source'], 'frames': 0, 'elapsed_seconds': 0, 'fps': 0.0,
+                  'speeding_vehicles': 0, 'error': 'Could not open video source'}
+    report['camera'] = camera['name']
+    return report
+
+def run_cameras(cameras, workers=None, torch_threads=None):
+    """Process every camera in a pool of worker processes and return the throughput report"""
+    workers = min(workers or CAMERA_WORKERS or os.cpu_count(), len(cameras))
+    torch_threads = torch_threads or TORCH_THREADS_PER_WORKER or max(1, os.cpu_count() // workers)
+    logging.info(f"Processing {len(cameras)} cameras with {workers} workers, "
+                 f"{torch_threads} torch thread(s) each")
+
+    start_time = time.time()
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(torch_threads,)) as pool:
+        futures = {pool.submit(run_camera, camera): camera['name'] for camera in cameras}
+        for future in as_completed(futures):
+            try:
+                report = future.result()
+            except Exception as e:
+                logging.error(f"Error processing camera {futures[future]}: {str(e)}")
+                report = {'camera': futures[future], 'frames': 0, 'fps': 0.0,
+                          'speeding_vehicles': 0, 'error': str(e)}
+            logging.info(f"Camera {report['camera']}: {report['frames']} frames at {report['fps']} fps, "
+                         f"{report['speeding_vehicles']} speeding vehicles")
+            reports.append(report)
+
+    elapsed = time.time() - start_time
+    total_frames = sum(report['frames'] for report in reports)
+    return {
+        'cameras': sorted(reports, key=lambda report: report['camera']),
+        'workers': workers,
+        'torch_threads_per_worker': torch_threads,
+        'total_frames': total_frames,
+        'elapsed_seconds': round(elapsed, 2),
+        'aggregate_fps': round(total_frames / elapsed, 1) if elapsed > 0 else 0.0,
+        'speeding_vehicles': sum(report['speeding_vehicles'] for report in reports)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-Camera Speed Detection')
+    parser.add_argument('--cameras', type=str, default=CAMERAS_CONFIG,
+                        help='JSON file listing the cameras and their ROI, calibration and speed limit')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--torch-threads', type=int, help='Torch threads per worker')
+    args = parser.parse_args()
+
+    cameras = load_cameras(args.cameras)
+    report = run_cameras(cameras, args.workers, args.torch_threads)
+
+    report_path = os.path.join(OUTPUT_DIR, 'cameras', 'throughput_report.json')
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    logging.info(f"Processed {report['total_frames']} frames from {len(cameras)} cameras in "
+                 f"{report['elapsed_seconds']}s ({report['aggregate_fps']} fps aggregate)")
+    logging.info(f"Throughput report saved to {report_path}")
+
+if __name__ == "__main__":
+    main()
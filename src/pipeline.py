@@ -0,0 +1,201 @@
+import logging
+import queue
+import threading
+import time
+
+# Sentinel passed down the queues when a stage has no more items
+STOP = object()
+
+
+class StageMeter:
+    """Frames-per-second readout for a single pipeline stage"""
+
+    def __init__(self):
+        self.frames = 0
+        self.busy_seconds = 0.0
+        self.started = None
+
+    def record(self, seconds):
+        if self.started is None:
+            self.started = time.perf_counter() - seconds
+        self.frames += 1
+        self.busy_seconds += seconds
+
+    @property
+    def fps(self):
+        """Frames per second the stage could sustain on its own"""
+        return self.frames / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    @property
+    def throughput(self):
+        """Frames per second the stage actually delivered"""
+        if self.started is None:
+            return 0.0
+        elapsed = time.perf_counter() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+
+class Stage(threading.Thread):
+    """Pipeline stage running on its own thread between two bounded queues"""
+
+    def __init__(self, name, fn, inbox, outbox, stop_event):
+        super().__init__(name=f"{name}-stage", daemon=True)
+        self.stage_name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.meter = StageMeter()
+        self.error = None  # exception that ended the stage, re-raised by Pipeline.results()
+
+    def next_item(self):
+        """Get the next input item, or STOP once the pipeline is stopped"""
+        while not self.stop_event.is_set():
+            try:
+                return self.inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return STOP
+
+    def put(self, item):
+        """Put an item on the output queue without blocking a stopped pipeline"""
+        while True:
+            try:
+                self.outbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.stop_event.is_set():
+                    return
+
+    def process(self, item):
+        start = time.perf_counter()
+        result = self.fn(item)
+        self.meter.record(time.perf_counter() - start)
+        return result
+
+    def run(self):
+        try:
+            while True:
+                item = self.next_item()
+                if item is STOP:
+                    break
+                result = self.process(item)
+                if result is not None:
+                    self.put(result)
+        except Exception as e:
+            logging.exception(f"Error in {self.stage_name} stage")
+            self.error = e
+            self.stop_event.set()
+        finally:
+            self.put(STOP)
+
+
+class SourceStage(Stage):
+    """First pipeline stage, producing items by calling read_fn until it returns None"""
+
+    def __init__(self, name, read_fn, outbox, stop_event):
+        super().__init__(name, read_fn, None, outbox, stop_event)
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                item = self.fn()
+                if item is None:
+                    break
+                self.meter.record(time.perf_counter() - start)
+                self.put(item)
+        except Exception as e:
+            logging.exception(f"Error in {self.stage_name} stage")
+            self.error = e
+            self.stop_event.set()
+        finally:
+            self.put(STOP)
+
+
+class Pipeline:
+    """Chain of threaded stages connected by bounded queues.
+
+    The source stage reads items, every following stage transforms them on
+    its own thread, and the final results are consumed on the calling thread
+    with results(). Each stage keeps an FPS meter so the bottleneck stage is
+    visible in the periodic report.
+    """
+
+    def __init__(self, queue_size, report_interval=5.0):
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.stop_event = threading.Event()
+        self.stages = []
+        self.output = None
+        self.meter = StageMeter()
+
+    def add_source(self, name, read_fn):
+        self.output = queue.Queue(maxsize=self.queue_size)
+        self.stages.append(SourceStage(name, read_fn, self.output, self.stop_event))
+
+    def add_stage(self, name, fn):
+        inbox = self.output
+        self.output = queue.Queue(maxsize=self.queue_size)
+        self.stages.append(Stage(name, fn, inbox, self.output, self.stop_event))
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        for stage in self.stages:
+            stage.join()
+
+    def results(self, name='output'):
+        """Yield the items leaving the last stage, timing the caller as one more stage.
+
+        A stage that failed stops the pipeline, and its exception is raised
+        here once the remaining items are consumed.
+        """
+        last_report = time.perf_counter()
+        while True:
+            try:
+                item = self.output.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop_event.is_set() and not any(stage.is_alive() for stage in self.stages):
+                    break
+                continue
+            if item is STOP:
+                break
+
+            start = time.perf_counter()
+            yield item
+            self.meter.record(time.perf_counter() - start)
+
+            if time.perf_counter() - last_report >= self.report_interval:
+                self.log_report(name)
+                last_report = time.perf_counter()
+        self.raise_error()
+
+    def raise_error(self):
+        """Re-raise the exception of the first failed stage on the calling thread"""
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def report(self, name='output'):
+        """FPS of every stage, keyed by stage name"""
+        meters = [(stage.stage_name, stage.meter) for stage in self.stages] + [(name, self.meter)]
+        return {
+            stage_name: {
+                'frames': meter.frames,
+                'fps': round(meter.fps, 1),
+                'throughput_fps': round(meter.throughput, 1)
+            }
+            for stage_name, meter in meters
+        }
+
+    def log_report(self, name='output'):
+        report = self.report(name)
+        readout = ", ".join(f"{stage_name}: {stats['fps']:.1f} fps" for stage_name, stats in report.items())
+        bottleneck = min(report, key=lambda stage_name: report[stage_name]['fps'] or float('inf'))
+        logging.info(f"Pipeline stage rates - {readout} (bottleneck: {bottleneck})")
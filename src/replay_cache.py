@@ -0,0 +1,72 @@
+import os
+import json
+import logging
+import numpy as np
+
+# How each recorded frame was tracked
+GATED, DETECTED, FLOW = 0, 1, 2
+
+class DetectionRecorder:
+    """Per-frame tracker output of a run, saved as a compact .npz for replay.
+
+    Rows of every frame are stored back to back, with an offset per frame,
+    so a recording of hours of video stays a handful of flat arrays.
+    """
+
+    def __init__(self):
+        self.frame_indices = []
+        self.timestamps = []
+        self.kinds = []
+        self.counts = []
+        self.track_ids = []
+        self.boxes = []
+        self.class_ids = []
+
+    def record(self, frame_index, timestamp, kind, track_ids=(), boxes=None, class_ids=()):
+        """Add the tracker output of one frame, before ROI filtering"""
+        self.frame_indices.append(frame_index)
+        self.timestamps.append(timestamp)
+        self.kinds.append(kind)
+        self.counts.append(len(track_ids))
+        if len(track_ids):
+            self.track_ids.append(np.asarray(track_ids, np.int32))
+            self.boxes.append(np.asarray(boxes, np.float32).reshape(-1, 4))
+            self.class_ids.append(np.asarray(class_ids, np.int16))
+
+    def save(self, path, video_path, frame_shape, fps, class_names):
+        """Write the recording atomically to path"""
+        offsets = np.zeros(len(self.counts) + 1, np.int64)
+        np.cumsum(self.counts, out=offsets[1:])
+
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(
+            temp_path,
+            frame_indices=np.asarray(self.frame_indices, np.int64),
+            timestamps=np.asarray(self.timestamps, np.float64),
+            kinds=np.asarray(self.kinds, np.int8),
+            offsets=offsets,
+            track_ids=np.concatenate(self.track_ids) if self.track_ids else np.zeros(0, np.int32),
+            boxes=np.concatenate(self.boxes) if self.boxes else np.zeros((0, 4), np.float32),
+            class_ids=np.concatenate(self.class_ids) if self.class_ids else np.zeros(0, np.int16),
+            frame_shape=np.asarray(frame_shape[:2], np.int64),
+            fps=np.float64(fps),
+            video_path=np.str_(video_path),
+            class_names=np.str_(json.dumps({str(k): v for k, v in class_names.items()}))
+        )
+        os.replace(temp_path, path)
+        logging.info(f"Saved tracker output of {len(self.counts)} frames to {path}")
+
+def load_recording(path):
+    """Load a recording saved by DetectionRecorder"""
+    with np.load(path) as data:
+        recording = {name: data[name] for name in data.files}
+    recording['video_path'] = str(recording['video_path'])
+    recording['fps'] = float(recording['fps'])
+    recording['class_names'] = {int(k): v for k, v in json.loads(str(recording['class_names'])).items()}
+    return recording
+
+def frame_rows(recording, i):
+    """Track IDs, boxes and class IDs of the i-th recorded frame"""
+    rows = slice(recording['offsets'][i], recording['offsets'][i + 1])
+    return (recording['track_ids'][rows].tolist(), recording['boxes'][rows],
+            recording['class_ids'][rows].tolist())
@@ -0,0 +1,283 @@
+import os
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+import torch
+from config import *
+from speed_detection import SpeedDetector
+from replay_cache import DetectionRecorder, load_recording, frame_rows
+from evidence_writer import evidence_stem
+from clip_recorder import run_name, clip_name, clip_track_id
+
+# Speed settings shared by the segment workers and the merged replay
+DETECTOR_SETTINGS = ('pixels_per_meter', 'speed_limit', 'speed_factor', 'speed_mode', 'speed_filter')
+
+def plan_segments(total_frames, fps, frame_skip, workers, segment_seconds=None,
+                  overlap_seconds=SEGMENT_OVERLAP_SECONDS):
+    """Cut the video into segments of whole keyframe groups, each processed from overlap frames earlier.
+
+    Every segment owns the frames [own_start, own_end). Its worker starts at
+    start to warm up the tracker on frames the previous segment owns, which
+    are also where tracks are stitched.
+    """
+    frame_skip = max(frame_skip, 1)
+    if segment_seconds:
+        length = int(segment_seconds * fps)
+    else:
+        length = math.ceil(total_frames / workers)
+    length = max(frame_skip, math.ceil(length / frame_skip) * frame_skip)
+    overlap = min(math.ceil(overlap_seconds * fps / frame_skip) * frame_skip, length)
+
+    segments = []
+    for index, own_start in enumerate(range(0, total_frames, length)):
+        segments.append({
+            'index': index,
+            'start': max(own_start - overlap, 0),
+            'own_start': own_start,
+            'own_end': min(own_start + length, total_frames)
+        })
+    return segments
+
+def init_worker(torch_threads):
+    """Limit the threads of each worker so the pool does not oversubscribe the cores"""
+    torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(1)
+
+def run_segment(video_path, segment, output_dir, frame_skip, settings):
+    """Track one segment of the video and record its tracker output"""
+    segment_dir = os.path.join(output_dir, 'segments', f"segment_{segment['index']:03d}")
+    recording_path = os.path.join(segment_dir, 'detections', 'tracker_output.npz')
+    detector = SpeedDetector(output_dir=segment_dir, **settings)
+    report = detector.process_video(video_path, headless=True, frame_skip=frame_skip, record_path=recording_path,
+                                    start=segment['start'], end=segment['own_end'])
+    if report is None:
+        raise RuntimeError(f"Could not open video file {video_path}")
+
+    del report['stages']
+    report.update(segment, output_dir=segment_dir, recording_path=recording_path)
+    return report
+
+def owned_frames(recording, segment, frame_skip):
+    """Mask of the recorded frames whose keyframe lies in the segment's own range"""
+    keyframes = recording['frame_indices'] * max(frame_skip, 1) - 1
+    return (keyframes >= segment['own_start']) & (keyframes < segment['own_end'])
+
+def stitch_tracks(previous, previous_ids, recording, segment, frame_skip, max_distance=SEGMENT_STITCH_DISTANCE):
+    """Map the local track IDs of a segment to the previous segment's global IDs where they overlap.
+
+    Tracks are paired by the mean distance of their box centers over the
+    overlap frames both segments tracked, closest pairs first.
+    """
+    previous_rows = {int(frame): i for i, frame in enumerate(previous['frame_indices'])}
+    overlap = ~owned_frames(recording, segment, frame_skip)
+    distances = {}
+    for i in np.flatnonzero(overlap):
+        j = previous_rows.get(int(recording['frame_indices'][i]))
+        if j is None:
+            continue
+        track_ids, boxes, _ = frame_rows(recording, i)
+        other_ids, other_boxes, _ = frame_rows(previous, j)
+        if not track_ids or not other_ids:
+            continue
+        pairwise = np.linalg.norm(boxes[:, None, :2] - other_boxes[None, :, :2], axis=2)
+        for a, track_id in enumerate(track_ids):
+            for b, other_id in enumerate(other_ids):
+                total, count = distances.get((track_id, other_id), (0.0, 0))
+                distances[(track_id, other_id)] = (total + float(pairwise[a, b]), count + 1)
+
+    stitched = {}
+    used = set()
+    pairs = sorted((total / count, track_id, other_id) for (track_id, other_id), (total, count) in distances.items())
+    for distance, track_id, other_id in pairs:
+        if distance > max_distance:
+            break
+        global_id = previous_ids[other_id]
+        if track_id in stitched or global_id in used:
+            continue
+        stitched[track_id] = global_id
+        used.add(global_id)
+    return stitched
+
+def merge_recordings(reports, frame_skip, merged_path):
+    """Join the owned frames of every segment into one recording with stitched global track IDs.
+
+    Returns the mapping of every segment's local track IDs to global ones and
+    the number of tracks stitched across a boundary.
+    """
+    merged = DetectionRecorder()
+    mappings = []
+    stitched_count = 0
+    next_id = 1
+    previous = previous_ids = None
+
+    for report in reports:
+        recording = load_recording(report['recording_path'])
+        ids = {}
+        if previous is not None:
+            ids = stitch_tracks(previous, previous_ids, recording, report, frame_skip)
+            stitched_count += len(ids)
+
+        owned = owned_frames(recording, report, frame_skip)
+        for i in np.flatnonzero(owned):
+            track_ids, boxes, class_ids = frame_rows(recording, i)
+            for track_id in track_ids:
+                if track_id not in ids:
+                    ids[track_id] = next_id
+                    next_id += 1
+            merged.record(int(recording['frame_indices'][i]), float(recording['timestamps'][i]),
+                          int(recording['kinds'][i]), [ids[track_id] for track_id in track_ids], boxes, class_ids)
+        mappings.append(ids)
+        previous, previous_ids = recording, ids
+
+    first = load_recording(reports[0]['recording_path'])
+    merged.save(merged_path, first['video_path'], first['frame_shape'], first['fps'], first['class_names'])
+    return mappings, stitched_count
+
+def merge_evidence(reports, mappings, frame_skip, output_dir, run):
+    """Copy the evidence and clips of every segment under the global track IDs.
+
+    Evidence of the overlap frames is left to the segment owning them, and
+    a stitched track keeps its EVIDENCE_BEST_K best crops over all segments.
+    Clips are renamed to the merged run. Returns the number of clips copied.
+    """
+    speeding_dir = os.path.join(output_dir, 'speeding')
+    candidates = {}
+    for report, ids in zip(reports, mappings):
+        segment_speeding = os.path.join(report['output_dir'], 'speeding')
+        for name in sorted(os.listdir(segment_speeding)):
+            if not name.startswith('vehicle_') or not name.endswith('.json'):
+                continue
+            with open(os.path.join(segment_speeding, name), 'r') as f:
+                sidecar = json.load(f)
+            keyframe = sidecar['frame'] * max(frame_skip, 1) - 1
+            if not report['own_start'] <= keyframe < report['own_end']:
+                continue
+            sidecar['path'] = os.path.join(segment_speeding, name[:-len('.json')] + '.jpg')
+            sidecar['track_id'] = ids[sidecar['track_id']]
+            candidates.setdefault(sidecar['track_id'], []).append(sidecar)
+
+    os.makedirs(os.path.join(speeding_dir, 'context'), exist_ok=True)
+    for track_id, sidecars in candidates.items():
+        for sidecar in sorted(sidecars, key=lambda s: (s['score'], s['frame']), reverse=True)[:EVIDENCE_BEST_K]:
+            source = sidecar.pop('path')
+            stem = evidence_stem(track_id, sidecar['frame'], sidecar['speed'])
+            shutil.copyfile(source, os.path.join(speeding_dir, stem + '.jpg'))
+            if sidecar['context_path'] is not None:
+                context_path = os.path.join(speeding_dir, 'context', f"{stem}_context.jpg")
+                shutil.copyfile(sidecar['context_path'], context_path)
+                sidecar['context_path'] = context_path
+            with open(os.path.join(speeding_dir, stem + '.json'), 'w') as f:
+                json.dump(sidecar, f, indent=4)
+
+    # A stitched vehicle keeps the clip of the segment it started speeding in
+    clips_dir = os.path.join(speeding_dir, 'clips')
+    clips = 0
+    for report, ids in zip(reports, mappings):
+        segment_clips = os.path.join(report['output_dir'], 'speeding', 'clips')
+        if not os.path.isdir(segment_clips):
+            continue
+        for name in sorted(os.listdir(segment_clips)):
+            track_id = clip_track_id(name)
+            if track_id not in ids:
+                continue
+            target = os.path.join(clips_dir, clip_name(run, ids[track_id]))
+            if not os.path.exists(target):
+                os.makedirs(clips_dir, exist_ok=True)
+                shutil.copyfile(os.path.join(segment_clips, name), target)
+                clips += 1
+    return clips
+
+def run_segmented(video_path, output_dir, frame_skip, settings, workers=None, torch_threads=None,
+                  segment_seconds=SEGMENT_SECONDS):
+    """Process a video as parallel segments and merge them into the results of a single run"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error(f"Could not open video file {video_path}")
+        return None
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or FPS
+    cap.release()
+
+    workers = workers or SEGMENT_WORKERS or os.cpu_count()
+    segments = plan_segments(total_frames, fps, frame_skip, workers, segment_seconds)
+    workers = min(workers, len(segments))
+    torch_threads = torch_threads or TORCH_THREADS_PER_WORKER or max(1, os.cpu_count() // workers)
+    logging.info(f"Processing {total_frames} frames of {video_path} as {len(segments)} segments "
+                 f"with {workers} workers, {torch_threads} torch thread(s) each")
+
+    start_time = time.time()
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(torch_threads,)) as pool:
+        futures = [pool.submit(run_segment, video_path, segment, output_dir, frame_skip, settings)
+                   for segment in segments]
+        for future in as_completed(futures):
+            report = future.result()
+            logging.info(f"Segment {report['index']}: frames {report['start']}-{report['own_end']}, "
+                         f"{report['frames']} processed at {report['fps']} fps")
+            reports.append(report)
+    reports.sort(key=lambda report: report['index'])
+    tracking_seconds = time.time() - start_time
+
+    # Stitch the segments into one recording and replay it for the combined speed data
+    merged_path = os.path.join(output_dir, 'detections', 'tracker_output.npz')
+    os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+    mappings, stitched = merge_recordings(reports, frame_skip, merged_path)
+    detector = SpeedDetector(output_dir=output_dir, load_detector=False, **settings)
+    run = run_name(video_path, start_time)
+    detector.detection_results['clips_written'] = merge_evidence(reports, mappings, frame_skip, output_dir, run)
+    results = detector.replay(merged_path)
+
+    elapsed = time.time() - start_time
+    return {
+        'video_path': video_path,
+        'segments': reports,
+        'workers': workers,
+        'torch_threads_per_worker': torch_threads,
+        'stitched_tracks': stitched,
+        'frames': results['total_frames'],
+        'tracking_seconds': round(tracking_seconds, 2),
+        'elapsed_seconds': round(elapsed, 2),
+        'fps': round(results['total_frames'] / elapsed, 1) if elapsed > 0 else 0.0,
+        'speeding_vehicles': results['speeding_vehicles']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Segmented Speed Detection of a Long Video')
+    parser.add_argument('--video', type=str, default=VIDEO_PATH)
+    parser.add_argument('--frame-skip', type=int, default=FRAME_SKIP,
+                        help='Run tracking on every Nth frame only (1 processes every frame)')
+    parser.add_argument('--segment-seconds', type=float, default=SEGMENT_SECONDS,
+                        help='Length of each segment, by default the video is split evenly over the workers')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--torch-threads', type=int, help='Torch threads per worker')
+    parser.add_argument('--pixels-per-meter', type=float, default=PIXELS_PER_METER)
+    parser.add_argument('--speed-limit', type=float, default=SPEED_LIMIT)
+    parser.add_argument('--speed-factor', type=float, default=SPEED_FACTOR)
+    parser.add_argument('--speed-mode', choices=('path', 'trap'), default=SPEED_MODE)
+    parser.add_argument('--speed-filter', choices=('kalman', 'mean'), default=SPEED_FILTER)
+    parser.add_argument('--output-dir', type=str, default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    settings = {name: getattr(args, name) for name in DETECTOR_SETTINGS}
+    report = run_segmented(args.video, args.output_dir, args.frame_skip, settings, args.workers,
+                           args.torch_threads, args.segment_seconds)
+    if report is None:
+        return
+
+    report_path = os.path.join(args.output_dir, 'segments', 'segment_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    logging.info(f"Processed {report['frames']} frames in {report['elapsed_seconds']}s ({report['fps']} fps), "
+                 f"{report['stitched_tracks']} tracks stitched across segment boundaries")
+    logging.info(f"Segment report saved to {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
 import cv2
 import numpy as np
-import torch
-from ultralytics import YOLO
 from collections import defaultdict
 import time
-from datetime import datetime
 import os
 import json
 import logging
+import argparse
+import pickle
+import heapq
+from contextlib import nullcontext
 from config import *
+try:
+    from ultralytics.trackers.basetrack import BaseTrack
+except ImportError:
+    # Tracker internals of another ultralytics layout, resumed runs start new track IDs
+    BaseTrack = None
+from track_store import TrackStore
+from pipeline import Pipeline
+from inference_backend import load_model
+from event_log import EventLog, read_events
+from evidence_writer import EvidenceWriter, box_bounds, evidence_stem
+from clip_recorder import ClipRecorder, run_name
+from live_source import LiveSource, RealtimeFileSource
+from load_controller import LoadController
+from tiled_detection import tile_grid, cut_detections, merge_detections, create_tracker, track_detections, TILED_TRACKING
+from ground_plane import GroundPlane
+from speed_trap import SpeedTrap
+from speed_filter import KalmanSpeedFilter
+from replay_cache import DetectionRecorder, load_recording, frame_rows, GATED, DETECTED, FLOW
 
 # Configure logging
 logging.basicConfig(
@@ -21,16 +40,46 @@ logging.basicConfig(
 )
 
 class SpeedDetector:
-    def __init__(self):
-        self.speed_limit = 80  # Updated speed limit to 80 km/h
-        self.model = YOLO(MODEL_PATH)
-        self.track_history = defaultdict(lambda: [])
-        self.speed_history = defaultdict(lambda: [])
-        self.screenshot_count = defaultdict(int)
+    def __init__(self, roi_points=ROI_POINTS, pixels_per_meter=PIXELS_PER_METER, speed_limit=SPEED_LIMIT,
+                 output_dir=OUTPUT_DIR, detector_interval=DETECTOR_INTERVAL, resume=False, load_detector=True,
+                 speed_factor=SPEED_FACTOR, smoothing_window=SPEED_SMOOTHING_WINDOW,
+                 image_points=HOMOGRAPHY_IMAGE_POINTS, ground_points=HOMOGRAPHY_GROUND_POINTS,
+                 speed_mode=SPEED_MODE, trap_lines=TRAP_LINES, trap_distance=TRAP_DISTANCE_METERS,
+                 speed_filter=SPEED_FILTER, load_control=LOAD_CONTROL, detection_width=DETECTION_WIDTH,
+                 far_field_region=FAR_FIELD_REGION, accel_noise=KALMAN_ACCEL_NOISE,
+                 measurement_noise=KALMAN_MEASUREMENT_NOISE):
+        self.speed_limit = speed_limit
+        self.output_dir = output_dir
+        
+        # Replays of recorded tracker output need no detector
+        self.model = load_model(MODEL_PATH, INFERENCE_BACKEND) if load_detector else None
+        self.class_names = self.model.names if self.model is not None else {}
+        self.tracks = TrackStore(TRACK_HISTORY_LENGTH, SPEED_HISTORY_LENGTH)
+        self.evidence_candidates = defaultdict(list)  # min-heap of the best evidence per track
         self.frame_count = 0
         self.fps = FPS
-        self.pixels_per_meter = PIXELS_PER_METER
-        self.roi_points = np.array(ROI_POINTS, np.int32)
+        self.pixels_per_meter = pixels_per_meter
+        self.speed_factor = speed_factor
+        self.smoothing_window = smoothing_window
+        self.roi_points = np.array(roi_points, np.int32)
+        
+        # With ground points, distances are measured on the road plane instead of with pixels_per_meter
+        self.image_points = image_points
+        self.ground_points = ground_points
+        self.ground_plane = None  # pixel to metre lookup, built for the frame size on the first frame
+        
+        # In trap mode vehicles are timed between two lines instead of along their track
+        if speed_mode not in ('path', 'trap'):
+            raise ValueError(f"Unknown speed mode '{speed_mode}', expected 'path' or 'trap'")
+        self.speed_trap = SpeedTrap(trap_lines, trap_distance) if speed_mode == 'trap' else None
+        
+        # Path speeds are smoothed with a Kalman filter over the track positions, or a moving average
+        if speed_filter not in ('kalman', 'mean'):
+            raise ValueError(f"Unknown speed filter '{speed_filter}', expected 'kalman' or 'mean'")
+        self.speed_filter = None
+        if speed_filter == 'kalman' and self.speed_trap is None:
+            self.speed_filter = KalmanSpeedFilter(accel_noise, measurement_noise)
+        self.confidence_z = SPEED_CONFIDENCE_Z
         
         # Optical flow parameters
         self.lk_params = dict(
@@ -39,53 +88,152 @@ class SpeedDetector:
             criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
         )
         self.prev_gray = None
-        self.prev_pts = None
+        self.prev_pts = None  # flow points of the tracked vehicles, one row per track
+        
+        # Detector keyframes, optical flow carries tracks in between
+        self.detector_interval = max(detector_interval, 1)
+        self.imgsz = INFERENCE_IMGSZ
+        self.frames_since_detection = 0
+        self.force_detection = False
+        self.flow_track_ids = []
+        self.flow_boxes = np.zeros((0, 4), np.float32)
+        self.flow_class_ids = []
         
         # Center detection parameters
         self.center_threshold = 50  # pixels threshold for center detection
         self.frame_center = None  # will be set when processing first frame
+        self.frame_shape = None
+        
+        # ROI parameters
+        self.roi_inference = ROI_INFERENCE
+        
+        # Detection and optical flow run on a working copy of the frame no wider than
+        # detection_width, optionally with full-resolution tiles over the far field
+        self.detection_width = detection_width
+        self.far_field_region = far_field_region
+        self.work_scale = 1.0
+        self.tiles = []
+        self.tile_masks = []
+        self.tile_tracker = None  # ByteTrack of the tiled detections
+        
+        # Motion gate parameters
+        self.motion_gate = MOTION_GATE
+        self.roi_rect = None  # ROI bounding rectangle, set when processing first frame
+        self.roi_mask = None  # ROI polygon mask inside roi_rect
+        self.gate_gray = None  # blurred ROI of the last frame that ran inference
+        self.frames_since_inference = 0
         
         # Create output directories
-        os.makedirs(os.path.join(OUTPUT_DIR, "speeding"), exist_ok=True)
-        os.makedirs(os.path.join(OUTPUT_DIR, "detections"), exist_ok=True)
+        os.makedirs(os.path.join(self.output_dir, "speeding"), exist_ok=True)
+        os.makedirs(os.path.join(self.output_dir, "detections"), exist_ok=True)
+        
+        # Tracks unseen for this many frames are finalized into the event log
+        self.track_timeout = TRACK_TIMEOUT_FRAMES
+        self.violations = set()
         
         # Initialize detection results
         self.detection_results = {
             'total_frames': 0,
             'total_vehicles': 0,
             'speeding_vehicles': 0,
+            'skipped_inferences': 0,
+            'flow_frames': 0,
+            'clips_written': 0,
+            'clip_dropped_frames': 0,
+            'load_adjustments': 0,
             'vehicle_details': {}
         }
         
+        # Tracker output of every frame, recorded for replays without inference
+        self.recorder = None
+        
+        # Periodic checkpoints let an interrupted run continue where it stopped
+        self.checkpoint_path = os.path.join(self.output_dir, 'checkpoint.pkl')
+        self.resume_video = None
+        self.resume_position = 0
+        self.pending_trackers = None  # pickled YOLO tracker, restored on the first detection
+        
+        # Stream track, speed and violation events as they happen. The event log,
+        # evidence writer and clip buffer are opened for each run by open_outputs().
+        self.events_path = os.path.join(self.output_dir, 'speeding', 'events.jsonl')
+        self.events_offset = None  # where a resumed run continues the event log
+        self.pending_clips = []  # violations of a resumed run still waiting for their clip
+        self.clip_run = None  # clip name prefix a resumed run keeps
+        self.events = None
+        self.evidence = None
+        self.clips = None
+        if resume:
+            self.load_checkpoint()
+        
+        # Under load, trade keyframes and inference size for throughput. Exported
+        # backends have a fixed input size, so only their keyframe interval adapts.
+        self.load_controller = None
+        if load_control and self.model is not None:
+            levels = INFERENCE_IMGSZ_LEVELS if INFERENCE_BACKEND == 'pytorch' else [INFERENCE_IMGSZ]
+            self.load_controller = LoadController(LOAD_TARGET_MS, levels, self.detector_interval,
+                                                  DETECTOR_INTERVAL_MAX, LOAD_CONTROL_WINDOW,
+                                                  LOAD_RECOVER_RATIO)
+            self.imgsz = self.load_controller.imgsz
+        
+    def open_outputs(self, video_path=None):
+        """Open the event log, evidence writer and clip buffer of a run over video_path.
+        
+        Every run closes them when it ends, so the same detector can process
+        one video after another. A resumed run continues the event log of its
+        checkpoint, any other run starts a new one. Clips are named after the
+        video and the start of the run, as track IDs restart with every run,
+        and a resumed run keeps the name of the run it continues.
+        """
+        self.events = EventLog(self.events_path, offset=self.events_offset)
+        self.events_offset = None
+        
+        # Evidence crops are written on a thread pool off the frame loop
+        self.evidence = EvidenceWriter(os.path.join(self.output_dir, 'speeding'), self.events)
+        
+        # Recent frames stay encoded in memory so violations get a clip without re-decoding
+        self.clips = None
+        if CLIP_BUFFER_MB:
+            self.clips = ClipRecorder(os.path.join(self.output_dir, 'speeding', 'clips'), self.events,
+                                      self.clip_run or run_name(video_path))
+            self.clips.pending = self.pending_clips
+        self.pending_clips = []
+        self.clip_run = None
+        
+        if self.load_controller is not None:
+            self.load_controller.events = self.events
+        
     def calibrate_speed(self, known_distance_meters, known_pixels):
         """Calibrate the speed calculation based on known distance"""
         self.pixels_per_meter = known_pixels / known_distance_meters
         logging.info(f"Calibrated pixels per meter: {self.pixels_per_meter}")
         
-    def calculate_speed(self, track_history, frame_count):
-        """Calculate speed using optical flow-based approach"""
-        if len(track_history) < 2:
-            return 0
-            
-        # Calculate displacement using optical flow
-        total_displacement = 0
-        for i in range(1, len(track_history)):
-            prev_point = track_history[i-1]
-            curr_point = track_history[i]
-            displacement = np.sqrt((curr_point[0] - prev_point[0])**2 + 
-                                 (curr_point[1] - prev_point[1])**2)
-            total_displacement += displacement
+    def calculate_speed(self, slots):
+        """Calculate the speed of every given track slot in one vectorized pass"""
+        if self.speed_trap is not None:
+            # A calibrated ground plane measures the distance between the crossings
+            distance = None if self.ground_plane is not None else self.speed_trap.distance
+            return self.speed_trap.speeds(self.tracks, slots, distance)
         
-        # Convert to meters
-        distance_meters = total_displacement / self.pixels_per_meter
+        counts = self.tracks.counts[slots]
         
-        # Calculate time using frame count and FPS
-        time_seconds = len(track_history) / self.fps
+        # Track positions are already in meters on the ground plane, so the path
+        # over the time between its oldest and newest point is the exact speed
+        if self.ground_plane is not None:
+            distance_meters = self.tracks.path_lengths(slots)
+            time_seconds = self.tracks.time_spans(slots)
+            speed_factor = 3.6
+        else:
+            # The pixel path length gets the empirically corrected scale. It was
+            # calibrated with the window of n points counted as n frame intervals,
+            # as when time was len(track) / fps, so that count is kept at any frame skip.
+            distance_meters = self.tracks.path_lengths(slots) / self.pixels_per_meter
+            time_seconds = self.tracks.time_spans(slots) * counts / np.maximum(counts - 1, 1)
+            speed_factor = self.speed_factor
         
         # Calculate speed in km/h using optical flow-based formula
-        speed_kmh = (distance_meters / time_seconds) * 2
+        speed_kmh = (distance_meters / np.where(time_seconds > 0, time_seconds, 1.0)) * speed_factor
         
-        return speed_kmh
+        return np.where((counts >= 2) & (time_seconds > 0), speed_kmh, 0.0)
 
     def is_vehicle_at_center(self, box, frame_shape):
         """Check if vehicle is near the center of the frame"""
@@ -101,226 +249,997 @@ class SpeedDetector:
         
         return distance <= self.center_threshold
 
-    def process_frame(self, frame):
-        """Process frame with optical flow-based tracking"""
-        self.frame_count += 1
-        self.detection_results['total_frames'] += 1
+    def init_roi(self, frame_shape):
+        """Precompute the ROI bounding rectangle and polygon mask for the frame size"""
+        self.frame_shape = tuple(frame_shape[:2])
+        if self.image_points is not None:
+            self.ground_plane = GroundPlane(self.image_points, self.ground_points, self.frame_shape)
+        
+        self.roi_rect, self.roi_mask = roi_region(self.roi_points, frame_shape)
+        
+        # The working frame has the ROI scaled down with it, track boxes stay in full-resolution pixels
+        self.work_size = (frame_shape[1], frame_shape[0])
+        self.work_rect, self.work_mask = self.roi_rect, self.roi_mask
+        if self.detection_width and frame_shape[1] > self.detection_width:
+            self.work_scale = self.detection_width / frame_shape[1]
+            self.work_size = (self.detection_width, max(1, round(frame_shape[0] * self.work_scale)))
+            work_points = np.round(self.roi_points * self.work_scale).astype(np.int32)
+            self.work_rect, self.work_mask = roi_region(work_points, self.work_size[::-1])
+            logging.info(f"Detecting on {self.work_size[0]}x{self.work_size[1]} working frames, "
+                         f"evidence from the {frame_shape[1]}x{frame_shape[0]} originals")
+        self.motion_min_pixels = max(1, int(cv2.countNonZero(self.work_mask) * MOTION_MIN_AREA))
+        
+        if self.far_field_region is not None and not TILED_TRACKING:
+            logging.warning("Far-field tiles need the ultralytics version in requirements.txt, detecting without them")
+        elif self.far_field_region is not None:
+            self.tiles = tile_grid(self.far_field_region, frame_shape)
+            self.tile_masks = [None] * len(self.tiles)
+            if self.roi_inference:
+                # Tiles are masked to the ROI polygon like the working frame, so both cut a vehicle alike
+                x, y, w, h = self.roi_rect
+                mask = np.zeros(frame_shape[:2], np.uint8)
+                mask[y:y + h, x:x + w] = self.roi_mask
+                self.tile_masks = [mask[y1:y2, x1:x2] for x1, y1, x2, y2 in self.tiles]
+            logging.info(f"Covering the far field with {len(self.tiles)} full-resolution tile(s)")
+
+    def in_roi(self, points):
+        """Vectorized point-in-polygon test of (x, y) points against the ROI mask"""
+        x, y, w, h = self.roi_rect
+        cols = np.floor(points[:, 0]).astype(np.int64) - x
+        rows = np.floor(points[:, 1]).astype(np.int64) - y
+        inside = (cols >= 0) & (cols < w) & (rows >= 0) & (rows < h)
+        inside[inside] = self.roi_mask[rows[inside], cols[inside]] > 0
+        return inside
+
+    def has_motion(self, roi_gray):
+        """Check whether anything moved inside the ROI polygon since the last inference"""
+        if self.gate_gray is None:
+            return True
+        
+        diff = cv2.absdiff(roi_gray, self.gate_gray)
+        _, moving = cv2.threshold(diff, MOTION_THRESHOLD, 255, cv2.THRESH_BINARY)
+        moving = cv2.bitwise_and(moving, self.work_mask)
+        return cv2.countNonZero(moving) >= self.motion_min_pixels
+
+    def detector_input(self, work):
+        """The working frame as the detector sees it, with the offset of its top-left corner"""
+        if self.roi_inference:
+            x, y, w, h = self.work_rect
+            crop = work[y:y + h, x:x + w]
+            return cv2.bitwise_and(crop, crop, mask=self.work_mask), x, y
+        return work, 0, 0
+
+    def detect(self, frame, work):
+        """Run YOLOv8 tracking and return the result with its track IDs, boxes and classes.
         
-        # Convert frame to grayscale for optical flow
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        The detector sees the working frame. With ROI inference it only sees
+        the ROI bounding rectangle, masked to the ROI polygon. Boxes are
+        mapped back to the full-resolution frame.
+        """
+        if self.tiles:
+            return self.detect_tiled(frame, work)
+        image, x, y = self.detector_input(work)
         
-        # Draw ROI
-        roi_frame = frame.copy()
-        cv2.polylines(roi_frame, [self.roi_points], True, (0, 255, 0), 2)
+        if self.pending_trackers is not None:
+            self.restore_trackers(image)
         
-        # Run YOLOv8 tracking
         results = self.model.track(
-            frame, 
+            image, 
             persist=True, 
             classes=VEHICLE_CLASSES,
             conf=VEHICLE_CONFIDENCE,
             iou=0.5,
+            imgsz=self.imgsz,
             show=False
         )
         
         # Get the boxes and track IDs
-        boxes = results[0].boxes.xywh.cpu()
+        boxes = results[0].boxes.xywh.cpu().numpy()
         track_ids = results[0].boxes.id.int().cpu().tolist() if results[0].boxes.id is not None else []
         class_ids = results[0].boxes.cls.int().cpu().tolist()
+        boxes = boxes[:len(track_ids)].copy()
+        boxes[:, 0] += x
+        boxes[:, 1] += y
+        boxes /= self.work_scale
+        return results[0], track_ids, boxes, class_ids[:len(track_ids)]
+
+    def detect_tiled(self, frame, work):
+        """Detect on the working frame and on full-resolution tiles of the far field, then track the merged boxes.
+        
+        Distant vehicles are too small to survive the downscale, so the tiles
+        see them at full resolution. Boxes of every image are mapped to the
+        full-resolution frame and duplicates from overlapping images are
+        suppressed before the detector's own ByteTrack assigns track IDs.
+        A vehicle straddling a tile seam is cut off in one tile and whole in
+        its neighbour, only the whole box is kept.
+        """
+        image, x, y = self.detector_input(work)
+        images = [(image, x, y, self.work_scale)]
+        for (x1, y1, x2, y2), mask in zip(self.tiles, self.tile_masks):
+            tile = frame[y1:y2, x1:x2]
+            if mask is not None:
+                tile = cv2.bitwise_and(tile, tile, mask=mask)
+            images.append((tile, x1, y1, 1.0))
+        
+        detections = []
+        cut = []
+        for image, x, y, scale in images:
+            result = self.model.predict(image, classes=VEHICLE_CLASSES, conf=VEHICLE_CONFIDENCE, iou=0.5,
+                                        imgsz=self.imgsz, verbose=False)[0]
+            boxes = result.boxes.xyxy.cpu().numpy().astype(np.float32).reshape(-1, 4)
+            boxes[:, [0, 2]] = (boxes[:, [0, 2]] + x) / scale
+            boxes[:, [1, 3]] = (boxes[:, [1, 3]] + y) / scale
+            detections.append(np.column_stack([boxes, result.boxes.conf.cpu().numpy(),
+                                               result.boxes.cls.cpu().numpy()]))
+            region = (x / scale, y / scale, (x + image.shape[1]) / scale, (y + image.shape[0]) / scale)
+            cut.append(cut_detections(boxes, region, frame.shape))
+        detections = merge_detections(np.concatenate(detections).astype(np.float32), np.concatenate(cut))
+        
+        if self.pending_trackers is not None:
+            self.tile_tracker = pickle.loads(self.pending_trackers)
+            self.pending_trackers = None
+        if self.tile_tracker is None:
+            self.tile_tracker = create_tracker(self.fps)
+        track_ids, boxes, class_ids = track_detections(self.tile_tracker, detections, frame)
+        return None, track_ids, boxes, class_ids
+
+    def restore_trackers(self, image):
+        """Put the checkpointed YOLO tracker state back into the predictor"""
+        # The predictor and its trackers only exist after a first track() call
+        self.model.track(np.zeros_like(image), persist=True, classes=VEHICLE_CLASSES,
+                         conf=VEHICLE_CONFIDENCE, iou=0.5, show=False)
+        if hasattr(self.model.predictor, 'trackers'):
+            self.model.predictor.trackers = pickle.loads(self.pending_trackers)
+        else:
+            logging.warning("This ultralytics version keeps no predictor trackers, tracks restart on resume")
+        self.pending_trackers = None
+
+    def seed_flow(self, track_ids, boxes, class_ids):
+        """Place a grid of points inside each detected box to follow with optical flow"""
+        offsets = ((np.arange(FLOW_GRID_SIZE) + 0.5) / FLOW_GRID_SIZE - 0.5) * FLOW_BOX_SCALE
+        grid_x, grid_y = np.meshgrid(offsets, offsets)
+        grid = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+        
+        # Flow points live on the working frame
+        points = boxes[:, None, :2] + grid[None] * boxes[:, None, 2:4]
+        self.prev_pts = (points * self.work_scale).astype(np.float32)
+        self.flow_track_ids = list(track_ids)
+        self.flow_boxes = boxes.copy()
+        self.flow_class_ids = list(class_ids)
+
+    def propagate(self, gray):
+        """Carry the tracks of the last detection forward with sparse Lucas-Kanade flow.
+        
+        Points failing the forward-backward check are dropped, and a track
+        moves by the median displacement of its remaining points. When too
+        many tracks lose their points the flow is considered to have drifted
+        and the next frame runs the detector again.
+        """
+        points = self.prev_pts
+        valid = ~np.isnan(points[..., 0])
+        if not valid.any():
+            self.force_detection = True
+            return [], np.zeros((0, 4), np.float32), []
         
-        # Visualize the results
-        annotated_frame = results[0].plot()
+        start = points[valid].reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, start, None, **self.lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, moved, None, **self.lk_params)
+        fb_error = np.linalg.norm((back - start).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < FLOW_MAX_FB_ERROR)
         
+        next_pts = np.full(points.shape, np.nan, np.float32)
+        next_pts[valid] = np.where(good[:, None], moved.reshape(-1, 2), np.nan)
+        reliable = (~np.isnan(next_pts[..., 0])).sum(axis=1) >= FLOW_MIN_POINTS
+        
+        if len(reliable) and 1 - reliable.mean() > FLOW_MAX_LOST_FRACTION:
+            self.force_detection = True
+        
+        # Unreliable tracks wait for the next detection
+        next_pts[~reliable] = np.nan
+        self.prev_pts = next_pts
+        self.flow_boxes[reliable, :2] += np.nanmedian(next_pts[reliable] - points[reliable], axis=1) / self.work_scale
+        
+        track_ids = [t for t, r in zip(self.flow_track_ids, reliable) if r]
+        class_ids = [c for c, r in zip(self.flow_class_ids, reliable) if r]
+        return track_ids, self.flow_boxes[reliable], class_ids
+
+    def drop_outside_roi(self, track_ids, boxes, class_ids):
+        """Keep only the vehicles whose centers are inside the ROI polygon"""
+        if not self.roi_inference or not track_ids:
+            return track_ids, boxes, class_ids
+        inside = self.in_roi(boxes[:, :2])
+        return ([t for t, i in zip(track_ids, inside) if i], boxes[inside],
+                [c for c, i in zip(class_ids, inside) if i])
+
+    def update_tracks(self, track_ids, boxes, class_ids, timestamp, detected=True):
+        """Add one position per vehicle to its track and check the vehicles' speeds"""
+        # Update track history and calculate speed for all vehicles at once
+        slots = self.tracks.slots_for(track_ids)
+        new = self.tracks.counts[slots] == 0
+        if detected:
+            self.tracks.touch(slots, class_ids, self.frame_count)
+        positions = None
+        if self.ground_plane is not None:
+            # The bottom center of the box is where the vehicle touches the road
+            bottoms = boxes[:, :2].copy()
+            bottoms[:, 1] += boxes[:, 3] / 2
+            positions = self.ground_plane.to_ground(bottoms)
+        if self.speed_trap is not None:
+            previous = self.tracks.newest(slots)
+        self.tracks.append_points(slots, boxes[:, :2], timestamp, positions)
+        if self.speed_trap is not None:
+            self.speed_trap.update(self.tracks, slots, *previous)
+        speeds = self.calculate_speed(slots)
+        moving = speeds > 0
+        avg_speeds = np.zeros_like(speeds)
+        speed_stds = np.zeros_like(speeds)
+        
+        if self.speed_filter is not None:
+            # Filter the positions in meters and convert to km/h the way calculate_speed does
+            if self.ground_plane is not None:
+                measured, scale = positions, 3.6
+            else:
+                measured, scale = boxes[:, :2] / self.pixels_per_meter, self.speed_factor
+            filtered, stds = self.speed_filter.update(self.tracks, slots, measured, timestamp)
+            avg_speeds[moving] = filtered[moving] * scale
+            speed_stds[moving] = stds[moving] * scale
+            self.tracks.append_speeds(slots[moving], avg_speeds[moving])
+        else:
+            # Update speed history for moving vehicles and use a moving average
+            # of the last speeds for a more stable reading
+            self.tracks.append_speeds(slots[moving], speeds[moving])
+            avg_speeds[moving] = self.tracks.recent_speed_means(slots[moving], speeds[moving],
+                                                                  self.smoothing_window)
+        
+        for track_id, class_id, is_new in zip(track_ids, class_ids, new):
+            if is_new:
+                self.events.emit('track_start', track_id=track_id, vehicle_type=self.class_names[class_id],
+                                 frame=self.frame_count, timestamp=timestamp)
+        
+        vehicles = []
         speeding_vehicles = []
         
-        # Update track history and check speed for all vehicles
-        for box, track_id, class_id in zip(boxes, track_ids, class_ids):
-            x, y, w, h = box
-            center = (float(x), float(y))
-            
-            # Update track history for all vehicles
-            track = self.track_history[track_id]
-            track.append(center)
-            
-            if len(track) > TRACK_HISTORY_LENGTH:
-                track.pop(0)
-            
-            # Calculate speed for all vehicles
-            speed = self.calculate_speed(track, self.frame_count)
-            
-            # Update speed history for all vehicles
+        # Check speed of all moving vehicles
+        for box, track_id, class_id, speed, avg_speed, speed_std in zip(boxes, track_ids, class_ids, speeds,
+                                                                         avg_speeds, speed_stds):
             if speed > 0:
-                speeds = self.speed_history[track_id]
-                speeds.append(speed)
-                if len(speeds) > SPEED_HISTORY_LENGTH:
-                    speeds.pop(0)
-                
-                # Use moving average of last 10 speeds for more stable reading
-                avg_speed = np.mean(speeds[-10:]) if len(speeds) >= 10 else speed
+                avg_speed = float(avg_speed)
+                speed_std = float(speed_std)
                 
                 # Get vehicle type
-                vehicle_type = self.model.names[class_id]
+                vehicle_type = self.class_names[class_id]
+                
+                if EVENT_LOG_SPEED_SAMPLES:
+                    self.events.emit('speed_sample', track_id=track_id, frame=self.frame_count,
+                                     timestamp=timestamp, speed=float(speed), average_speed=avg_speed,
+                                     speed_std=speed_std)
+                
+                vehicles.append({
+                    'track_id': track_id,
+                    'box': box.copy(),
+                    'speed': avg_speed,
+                    'speed_std': speed_std,
+                    'vehicle_type': vehicle_type,
+                    'track': self.tracks.track(track_id).astype(np.int32)
+                })
                 
-                # Check if vehicle is speeding
-                if avg_speed > self.speed_limit:
+                # Check if vehicle is speeding, with the filtered speed only once
+                # its lower confidence bound is above the limit
+                if avg_speed - self.confidence_z * speed_std > self.speed_limit:
+                    new_violation = track_id not in self.violations
                     speeding_vehicles.append({
                         'track_id': track_id,
+                        'box': box.copy(),
                         'speed': avg_speed,
-                        'vehicle_type': vehicle_type
+                        'speed_std': speed_std,
+                        'vehicle_type': vehicle_type,
+                        'new_violation': new_violation
                     })
-                
-                # Determine text color based on speed
-                if avg_speed > 100:
-                    text_color = (0, 0, 255)  # Red for very high speed
-                elif avg_speed > self.speed_limit:
-                    text_color = (0, 165, 255)  # Orange for high speed
-                else:
-                    text_color = (0, 255, 0)  # Green for moderate speed
-                
-                # Prepare text
-                id_text = f"ID: {track_id} - {vehicle_type}"
-                speed_text = f"{avg_speed:.1f} km/h"
-                
-                # Calculate text size and position
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 0.8
-                thickness = 2
-                
-                # Get text size for background rectangle
-                (id_width, id_height), _ = cv2.getTextSize(id_text, font, font_scale, thickness)
-                (speed_width, speed_height), _ = cv2.getTextSize(speed_text, font, font_scale, thickness)
-                
-                # Calculate rectangle dimensions
-                rect_width = max(id_width, speed_width) + 20
-                rect_height = id_height + speed_height + 30
-                
-                # Draw background rectangle
-                cv2.rectangle(annotated_frame,
-                            (int(x - w/2), int(y - h/2 - rect_height)),
-                            (int(x - w/2 + rect_width), int(y - h/2)),
-                            (0, 0, 0), -1)
-                
-                # Draw vehicle ID and type
-                cv2.putText(annotated_frame, id_text,
-                          (int(x - w/2 + 10), int(y - h/2 - 20)),
-                          font, font_scale, (255, 255, 255), thickness)
-                
-                # Draw speed with color based on speed value
-                cv2.putText(annotated_frame, speed_text,
-                          (int(x - w/2 + 10), int(y - h/2 - 5)),
-                          font, font_scale, text_color, thickness)
-                
-                # Draw track
-                points = np.array(track, dtype=np.int32)
-                cv2.polylines(annotated_frame, [points], False, text_color, 2)
+                    if new_violation:
+                        self.violations.add(track_id)
+                        logging.info(f"Speeding vehicle {track_id} detected! Speed: {avg_speed:.1f} km/h")
+                        self.events.emit('violation', track_id=track_id, vehicle_type=vehicle_type,
+                                         speed=avg_speed, speed_std=speed_std, speed_limit=self.speed_limit,
+                                         frame=self.frame_count, timestamp=timestamp)
         
         # Update total vehicles count
         if track_ids:
             self.detection_results['total_vehicles'] = max(self.detection_results['total_vehicles'], max(track_ids))
         
-        # Update optical flow tracking
-        self.prev_gray = gray.copy()
-        self.prev_pts = np.array([track[-1] for track in self.track_history.values() if track], dtype=np.float32)
+        return vehicles, speeding_vehicles
+
+    def update(self, frame, timestamp=None):
+        """Run tracking on a frame and update the track and speed state.
+        
+        timestamp is the frame's position in the video in seconds; without it
+        frames are assumed to be 1 / FPS apart. With a detector interval above
+        one, frames between detector keyframes are tracked with optical flow.
+        """
+        self.frame_count += 1
+        self.detection_results['total_frames'] += 1
+        if timestamp is None:
+            timestamp = self.frame_count / self.fps
+        
+        if self.roi_mask is None:
+            self.init_roi(frame.shape)
+        
+        # Convert the working frame to grayscale for optical flow
+        work = frame
+        if self.work_scale != 1.0:
+            work = cv2.resize(frame, self.work_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(work, cv2.COLOR_BGR2GRAY)
+        
+        result = None
+        detected = (self.prev_pts is None or self.force_detection
+                    or self.frames_since_detection + 1 >= self.detector_interval)
+        
+        if detected:
+            # Skip inference on static frames, at most MOTION_GATE_MAX_SKIP in a row.
+            # Skipped frames do not count towards the track timeout.
+            if self.motion_gate:
+                x, y, w, h = self.work_rect
+                roi_gray = cv2.GaussianBlur(gray[y:y + h, x:x + w], (5, 5), 0)
+                if self.frames_since_inference < MOTION_GATE_MAX_SKIP and not self.has_motion(roi_gray):
+                    self.frames_since_inference += 1
+                    self.detection_results['skipped_inferences'] += 1
+                    if self.recorder is not None:
+                        self.recorder.record(self.frame_count, timestamp, GATED)
+                    self.prev_gray = gray
+                    return {'frame': frame, 'timestamp': timestamp, 'result': None,
+                            'vehicles': [], 'speeding_vehicles': []}
+                
+                # Compare against the last inference frame so slow motion accumulates
+                self.gate_gray = roi_gray
+                self.frames_since_inference = 0
+            
+            result, track_ids, boxes, class_ids = self.detect(frame, work)
+            if self.recorder is not None:
+                self.recorder.record(self.frame_count, timestamp, DETECTED, track_ids, boxes, class_ids)
+            track_ids, boxes, class_ids = self.drop_outside_roi(track_ids, boxes, class_ids)
+            self.seed_flow(track_ids, boxes, class_ids)
+            self.frames_since_detection = 0
+            self.force_detection = False
+        else:
+            track_ids, boxes, class_ids = self.propagate(gray)
+            if self.recorder is not None:
+                self.recorder.record(self.frame_count, timestamp, FLOW, track_ids, boxes, class_ids)
+            track_ids, boxes, class_ids = self.drop_outside_roi(track_ids, boxes, class_ids)
+            self.frames_since_detection += 1
+            self.detection_results['flow_frames'] += 1
+        
+        vehicles, speeding_vehicles = self.update_tracks(track_ids, boxes, class_ids, timestamp, detected)
+        self.collect_evidence(frame, speeding_vehicles)
+        
+        # Flush and evict vehicles that have left the scene
+        self.finalize_stale_tracks()
+        
+        # Keep this frame for optical flow on the next one
+        self.prev_gray = gray
+        self.events.flush()
+        
+        return {
+            'frame': frame,
+            'timestamp': timestamp,
+            'result': result,
+            'vehicles': vehicles,
+            'speeding_vehicles': speeding_vehicles
+        }
+
+    def annotate(self, frame_result):
+        """Draw detections, speeds and tracks for the output of update()"""
+        # Visualize the results, frames without a detector run have none
+        if frame_result['result'] is not None and not self.roi_inference:
+            annotated_frame = frame_result['result'].plot()
+            if self.work_scale != 1.0:
+                annotated_frame = cv2.resize(annotated_frame, (self.frame_shape[1], self.frame_shape[0]))
+        else:
+            annotated_frame = frame_result['frame'].copy()
+        
+        if self.roi_inference:
+            # Paste the detections drawn on the ROI crop back inside the polygon
+            if frame_result['result'] is not None:
+                x, y, w, h = self.roi_rect
+                plot = frame_result['result'].plot()
+                if plot.shape[:2] != (h, w):
+                    plot = cv2.resize(plot, (w, h))
+                np.copyto(annotated_frame[y:y + h, x:x + w], plot, where=self.roi_mask[..., None] > 0)
+            cv2.polylines(annotated_frame, [self.roi_points], True, (0, 255, 0), 2)
+        
+        if self.speed_trap is not None:
+            cv2.polylines(annotated_frame, self.speed_trap.lines.astype(np.int32), False, (255, 255, 0), 2)
+        
+        for vehicle in frame_result['vehicles']:
+            x, y, w, h = vehicle['box']
+            avg_speed = vehicle['speed']
+            
+            # Determine text color based on speed
+            if avg_speed > 100:
+                text_color = (0, 0, 255)  # Red for very high speed
+            elif avg_speed > self.speed_limit:
+                text_color = (0, 165, 255)  # Orange for high speed
+            else:
+                text_color = (0, 255, 0)  # Green for moderate speed
+            
+            # Prepare text
+            id_text = f"ID: {vehicle['track_id']} - {vehicle['vehicle_type']}"
+            speed_text = f"{avg_speed:.1f} km/h"
+            if vehicle['speed_std'] > 0:
+                speed_text = f"{avg_speed:.1f} +/- {self.confidence_z * vehicle['speed_std']:.1f} km/h"
+            
+            # Calculate text size and position
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            font_scale = 0.8
+            thickness = 2
+            
+            # Get text size for background rectangle
+            (id_width, id_height), _ = cv2.getTextSize(id_text, font, font_scale, thickness)
+            (speed_width, speed_height), _ = cv2.getTextSize(speed_text, font, font_scale, thickness)
+            
+            # Calculate rectangle dimensions
+            rect_width = max(id_width, speed_width) + 20
+            rect_height = id_height + speed_height + 30
+            
+            # Draw background rectangle
+            cv2.rectangle(annotated_frame,
+                        (int(x - w/2), int(y - h/2 - rect_height)),
+                        (int(x - w/2 + rect_width), int(y - h/2)),
+                        (0, 0, 0), -1)
+            
+            # Draw vehicle ID and type
+            cv2.putText(annotated_frame, id_text,
+                      (int(x - w/2 + 10), int(y - h/2 - 20)),
+                      font, font_scale, (255, 255, 255), thickness)
+            
+            # Draw speed with color based on speed value
+            cv2.putText(annotated_frame, speed_text,
+                      (int(x - w/2 + 10), int(y - h/2 - 5)),
+                      font, font_scale, text_color, thickness)
+            
+            # Draw track
+            cv2.polylines(annotated_frame, [vehicle['track']], False, text_color, 2)
+        
+        return annotated_frame
+
+    def process_frame(self, frame, timestamp=None):
+        """Process frame with optical flow-based tracking"""
+        frame_result = self.update(frame, timestamp)
+        return self.annotate(frame_result), frame_result['speeding_vehicles']
+
+    def collect_evidence(self, frame, speeding_vehicles):
+        """Keep the EVIDENCE_BEST_K best views of every speeding vehicle in a bounded heap.
+        
+        Views are scored by the Laplacian variance of the box, which favours
+        sharp plates, times its area, which favours vehicles close to the camera.
+        """
+        for vehicle in speeding_vehicles:
+            bbox = box_bounds(vehicle['box'], frame.shape)
+            x1, y1, x2, y2 = bbox
+            if x2 <= x1 or y2 <= y1:
+                continue
+            patch = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+            score = float(cv2.Laplacian(patch, cv2.CV_64F).var() * patch.size)
+            
+            # Only copy the crop out of the frame if it makes the heap
+            heap = self.evidence_candidates[vehicle['track_id']]
+            if len(heap) >= EVIDENCE_BEST_K and score <= heap[0][0]:
+                continue
+            candidate = self.evidence.capture(frame, bbox)
+            candidate.update(track_id=vehicle['track_id'], speed=vehicle['speed'],
+                             frame=self.frame_count, score=score)
+            entry = (score, self.frame_count, candidate)
+            if len(heap) < EVIDENCE_BEST_K:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+
+    def write_evidence(self, track_id, summary=None):
+        """Queue the evidence kept for a track for writing, best first, and return how many.
+        
+        With a summary, the track_finalize event follows once the evidence is
+        written, so the plate follower has read every crop of a vehicle when
+        it sees the vehicle finalized.
+        """
+        candidates = sorted(self.evidence_candidates.pop(track_id, []), key=lambda entry: entry[:2], reverse=True)
+        evidence = []
+        for _, _, candidate in candidates:
+            filename = evidence_stem(track_id, candidate['frame'], candidate['speed']) + '.jpg'
+            candidate['path'] = os.path.join(self.output_dir, "speeding", filename)
+            evidence.append(candidate)
+        if summary is None:
+            self.evidence.submit(evidence)
+        else:
+            self.evidence.submit(evidence, 'track_finalize', **summary)
+        return len(evidence)
+
+    def summarize_speeds(self, speeds):
+        """Summarize a vehicle's speed samples as stored in speed_data.json"""
+        return {
+            'speeds': speeds[:MAX_SCREENSHOTS_PER_VEHICLE],
+            'average_speed': sum(speeds[:MAX_SCREENSHOTS_PER_VEHICLE]) / len(speeds[:MAX_SCREENSHOTS_PER_VEHICLE]) if speeds else 0,
+            'max_speed': max(speeds) if speeds else 0
+        }
+
+    def finalize_track(self, track_id):
+        """Flush a per-vehicle summary to disk and evict the track"""
+        slot = self.tracks.slot_of[track_id]
+        summary = {
+            'track_id': track_id,
+            'vehicle_type': self.class_names[int(self.tracks.class_ids[slot])],
+            'first_frame': int(self.tracks.first_seen[slot]),
+            'last_frame': int(self.tracks.last_seen[slot]),
+            'screenshots': len(self.evidence_candidates.get(track_id, [])),
+            'violation': track_id in self.violations
+        }
+        summary.update(self.summarize_speeds(self.tracks.speed_samples(track_id)))
+        self.write_evidence(track_id, summary)
+        
+        self.tracks.release(track_id)
+        self.violations.discard(track_id)
+
+    def finalize_stale_tracks(self):
+        """Finalize every track missed in the last track_timeout detection frames"""
+        for track_id in self.tracks.stale_ids(self.track_timeout):
+            self.finalize_track(track_id)
+
+    def load_track_summaries(self):
+        """Read back the summaries of all finalized tracks from the event log, by track ID.
+        
+        The evidence writer threads log them as each track's evidence is
+        written, so their order in the log varies from run to run.
+        """
+        self.events.flush()
+        return sorted(read_events(self.events_path, 'track_finalize'), key=lambda summary: summary['track_id'])
+
+    def save_checkpoint(self, video_path, position):
+        """Atomically write the run state after the frame that ends at video position"""
+        trackers = getattr(getattr(self.model, 'predictor', None), 'trackers', None)
+        if self.tiles:
+            trackers = self.tile_tracker
+        try:
+            trackers = pickle.dumps(trackers) if trackers is not None else None
+        except Exception as e:
+            logging.warning(f"Could not checkpoint the YOLO tracker, it restarts on resume: {str(e)}")
+            trackers = None
+        
+        # Evidence written so far must be on disk and in the event log
+        self.evidence.drain()
+        
+        # Clip counts of the run so far, a resumed run adds its own. The clip
+        # lock is held until the event log offset is taken, so every clip is
+        # either written and logged before the offset or pending in the checkpoint.
+        detection_results = dict(self.detection_results)
+        pending_clips = []
+        with self.clips.lock if self.clips is not None else nullcontext():
+            if self.clips is not None:
+                self.clips.drain()
+                detection_results['clips_written'] += self.clips.clips_written
+                detection_results['clip_dropped_frames'] += self.clips.dropped_frames
+                pending_clips = list(self.clips.pending)
+            
+            state = {
+                'video_path': video_path,
+                'position': position,
+                'frame_count': self.frame_count,
+                'tracks': self.tracks,
+                'evidence_candidates': dict(self.evidence_candidates),
+                'violations': self.violations,
+                'detection_results': detection_results,
+                'pending_clips': pending_clips,
+                'clip_run': self.clips.run if self.clips is not None else None,
+                'recorder': self.recorder,
+                'trackers': trackers,
+                'next_track_id': getattr(BaseTrack, '_count', None),
+                'events_offset': self.events.tell()
+            }
+        
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(temp_path, self.checkpoint_path)
+        logging.info(f"Checkpoint saved at video frame {position}")
+
+    def load_checkpoint(self):
+        """Restore the run state of the last checkpoint, or start afresh without one"""
+        if not os.path.exists(self.checkpoint_path):
+            logging.warning(f"No checkpoint found at {self.checkpoint_path}, starting from the first frame")
+            return
+        
+        with open(self.checkpoint_path, 'rb') as f:
+            state = pickle.load(f)
+        
+        self.resume_video = state['video_path']
+        self.resume_position = state['position']
+        self.frame_count = state['frame_count']
+        self.tracks = state['tracks']
+        self.evidence_candidates = defaultdict(list, state['evidence_candidates'])
+        self.violations = state['violations']
+        self.detection_results = state['detection_results']
+        self.recorder = state['recorder']
+        self.pending_trackers = state['trackers']
+        self.pending_clips = state['pending_clips']
+        self.clip_run = state['clip_run']
+        
+        # Keep new track IDs clear of the restored tracks, even if the tracker itself restarts
+        if hasattr(BaseTrack, '_count') and state['next_track_id'] is not None:
+            BaseTrack._count = max(BaseTrack._count, state['next_track_id'])
+        else:
+            logging.warning("Cannot restore the tracker ID counter, resumed tracks may get new IDs")
         
-        return annotated_frame, speeding_vehicles
+        # Drop the events written after the checkpoint, they are produced again
+        self.events_offset = state['events_offset']
+        logging.info(f"Resuming {self.resume_video} from video frame {self.resume_position}")
 
     def save_speeding_data(self):
         """Save the speed history and detection results"""
-        # Count speeding vehicles
-        speeding_vehicles = 0
-        speeding_ids = []
+        # Finalize the vehicles still in view so every track is on disk
+        for track_id in list(self.tracks.slot_of):
+            self.finalize_track(track_id)
+        self.evidence.drain()
+        summaries = [summary for summary in self.load_track_summaries() if summary['speeds']]
         
         # Save speed data
         data = {
             'vehicle_speeds': {
-                str(track_id): {
-                    'speeds': speeds[:MAX_SCREENSHOTS_PER_VEHICLE],
-                    'average_speed': sum(speeds[:MAX_SCREENSHOTS_PER_VEHICLE]) / len(speeds[:MAX_SCREENSHOTS_PER_VEHICLE]) if speeds else 0,
-                    'max_speed': max(speeds) if speeds else 0
+                str(summary['track_id']): {
+                    'speeds': summary['speeds'],
+                    'average_speed': summary['average_speed'],
+                    'max_speed': summary['max_speed'],
+                    'violation': summary['violation']
                 }
-                for track_id, speeds in self.speed_history.items()
+                for summary in summaries
             }
         }
         
-        # Count vehicles that actually exceeded the speed limit
-        for track_id, speeds in self.speed_history.items():
-            max_speed = max(speeds) if speeds else 0
-            if max_speed > self.speed_limit:
-                speeding_vehicles += 1
-                speeding_ids.append(track_id)
+        # Count vehicles that actually exceeded the speed limit. Filtered speeds
+        # only count once their lower confidence bound was above it.
+        if self.speed_filter is not None:
+            speeding_ids = [summary['track_id'] for summary in summaries if summary['violation']]
+        else:
+            speeding_ids = [summary['track_id'] for summary in summaries if summary['max_speed'] > self.speed_limit]
+        speeding_vehicles = len(speeding_ids)
         
         # Update detection results with correct count of speeding vehicles
         self.detection_results['speeding_vehicles'] = speeding_vehicles
         self.detection_results['speeding_vehicle_ids'] = speeding_ids
         
         # Save speed data
-        with open(os.path.join(OUTPUT_DIR, 'speeding', 'speed_data.json'), 'w') as f:
+        with open(os.path.join(self.output_dir, 'speeding', 'speed_data.json'), 'w') as f:
             json.dump(data, f, indent=4)
         
         # Save detection results
-        with open(os.path.join(OUTPUT_DIR, 'detections', 'detection_results.json'), 'w') as f:
+        with open(os.path.join(self.output_dir, 'detections', 'detection_results.json'), 'w') as f:
             json.dump(self.detection_results, f, indent=4)
         
         logging.info("Speed data and detection results saved successfully")
         logging.info(f"Total frames processed: {self.detection_results['total_frames']}")
         logging.info(f"Total vehicles detected: {self.detection_results['total_vehicles']}")
+        logging.info(f"Inferences skipped by the motion gate: {self.detection_results['skipped_inferences']}")
+        logging.info(f"Frames tracked with optical flow: {self.detection_results['flow_frames']}")
+        logging.info(f"Violation clips saved: {self.detection_results['clips_written']} "
+                     f"({self.detection_results['clip_dropped_frames']} frames dropped by the buffer budget)")
         logging.info(f"Speeding vehicles: {speeding_vehicles}")
         logging.info(f"Speeding vehicle IDs: {speeding_ids}")
 
-def main():
-    # Initialize speed detector
-    detector = SpeedDetector()
-    
-    # Open video file
-    cap = cv2.VideoCapture(VIDEO_PATH)
-    if not cap.isOpened():
-        logging.error("Could not open video file")
-        return
-    
-    try:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+    def replay(self, recording_path):
+        """Re-run speed estimation, the violation logic and save_speeding_data on recorded tracker output.
+        
+        No frames are decoded and nothing is inferred, so the calibration,
+        speed limit, ROI and smoothing can be re-tuned in seconds. Evidence
+        crops and clips need the frames and are not produced.
+        """
+        recording = load_recording(recording_path)
+        self.fps = recording['fps']
+        self.class_names = recording['class_names']
+        self.init_roi(recording['frame_shape'])
+        self.open_outputs()
+        
+        start_time = time.time()
+        self.events.emit('run_start', video_path=recording['video_path'], speed_limit=self.speed_limit,
+                         replay=recording_path)
+        for i, kind in enumerate(recording['kinds']):
+            self.frame_count = int(recording['frame_indices'][i])
+            self.detection_results['total_frames'] += 1
+            if kind == GATED:
+                self.detection_results['skipped_inferences'] += 1
+                continue
+            if kind == FLOW:
+                self.detection_results['flow_frames'] += 1
+            
+            track_ids, boxes, class_ids = self.drop_outside_roi(*frame_rows(recording, i))
+            self.update_tracks(track_ids, boxes, class_ids, float(recording['timestamps'][i]), kind == DETECTED)
+            self.finalize_stale_tracks()
+        
+        self.save_speeding_data()
+        self.evidence.close()
+        if self.clips is not None:
+            self.clips.close()
+        self.events.emit('run_end', **self.detection_results)
+        self.events.close()
+        logging.info(f"Replayed {len(recording['kinds'])} frames of {recording['video_path']} "
+                     f"in {time.time() - start_time:.2f}s")
+        return self.detection_results
+
+    def process_video(self, video_path, headless=HEADLESS, frame_skip=FRAME_SKIP, record_path=None,
+                      start=0, end=None, live_source=None):
+        """Run the detection pipeline over a video and save the results.
+        
+        Every CHECKPOINT_INTERVAL processed frames the run state is saved so
+        a detector created with resume=True continues from there. With a
+        record_path the tracker output of every frame is saved there for
+        replay(). start and end limit the run to the video frames in
+        [start, end), numbered as in a run over the whole video. With a
+        live_source frames come from its latest-frame-wins grabber instead,
+        stamped with their capture time, and frames past its latency budget
+        are dropped. A live run also checkpoints when it stops. Returns a report with the number of frames, the
+        wall-clock FPS and the FPS of every pipeline stage, or None if the
+        video cannot be opened.
+        """
+        if self.resume_video is not None and self.resume_video != video_path:
+            raise ValueError(f"Checkpoint is for {self.resume_video}, not {video_path}")
+        
+        # Open the live stream or the video file
+        cap = None
+        if live_source is not None:
+            if not live_source.open():
+                logging.error(f"Could not open live stream {video_path}")
+                return None
+        else:
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                logging.error(f"Could not open video file {video_path}")
+                return None
+            if self.resume_position:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, self.resume_position)
+            elif start:
+                # Count processed frames as if the video had been read from its first frame
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                self.frame_count = start // max(frame_skip, 1)
+        if record_path and self.recorder is None:
+            self.recorder = DetectionRecorder()
+        self.open_outputs(video_path)
+        # Frames before the start of a segment or a resumed run were not processed by this run
+        first_frame = self.frame_count
+        
+        progress = {
+            'position': self.resume_position or start,
+            'checkpoint': self.frame_count,
+            'finished': False
+        }
+        
+        def decode():
+            if live_source is not None:
+                keyframe = live_source.read()
+            else:
+                keyframe = read_frame(cap, frame_skip)
+                if keyframe is not None and end is not None and keyframe[2] > end:
+                    keyframe = None
+            if keyframe is None:
+                progress['finished'] = True
+            return keyframe
+        
+        def track(keyframe):
+            frame, timestamp, position = keyframe
+            # Frames that aged past the budget while queued are dropped, not tracked late
+            if live_source is not None and live_source.stale(timestamp):
+                return None
+            if CHECKPOINT_INTERVAL and self.frame_count - progress['checkpoint'] >= CHECKPOINT_INTERVAL:
+                self.save_checkpoint(video_path, progress['position'])
+                progress['checkpoint'] = self.frame_count
+            
+            started = time.perf_counter()
+            frame_result = self.update(frame, timestamp)
+            progress['position'] = position
+            
+            # Schedule clips of the vehicles that just started speeding. Triggering them here
+            # rather than in the clip stage puts every violation up to a checkpoint in it.
+            if self.clips is not None:
+                for vehicle in frame_result['speeding_vehicles']:
+                    if vehicle['new_violation']:
+                        self.clips.trigger(vehicle['track_id'], timestamp)
+            if self.load_controller is not None and self.load_controller.observe(time.perf_counter() - started,
+                                                                                 self.frame_count):
+                self.imgsz = self.load_controller.imgsz
+                self.detector_interval = self.load_controller.interval
+                self.detection_results['load_adjustments'] += 1
+            return frame_result
+        
+        def record(frame_result):
+            # Buffer the raw frame, writing the clips it completes
+            self.clips.push(frame_result['frame'], frame_result['timestamp'])
+            return frame_result
+        
+        def annotate(frame_result):
+            # Headless runs draw nothing, evidence is cropped from the raw frames
+            if not headless:
+                frame_result['annotated_frame'] = self.annotate(frame_result)
+            return frame_result
+        
+        # Decode, inference, clip buffering and annotation each run on their own thread.
+        # Live frames are not queued up, the grabber already holds the newest one.
+        pipeline = Pipeline(PIPELINE_QUEUE_SIZE if live_source is None else 1, PIPELINE_REPORT_INTERVAL)
+        frame_skip = max(frame_skip, 1)
+        if live_source is not None:
+            logging.info(f"Tracking the newest frame of {video_path}, "
+                         f"latency budget {live_source.latency_budget}s")
+        else:
+            logging.info(f"Running tracking on every {frame_skip} frame(s)")
+        pipeline.add_source("decode", decode)
+        pipeline.add_stage("track", track)
+        if self.clips is not None:
+            pipeline.add_stage("clips", record)
+        pipeline.add_stage("annotate", annotate)
+        
+        start_time = time.time()
+        if self.resume_position:
+            self.events.emit('run_resume', video_path=video_path, position=self.resume_position)
+        else:
+            self.events.emit('run_start', video_path=video_path, speed_limit=self.speed_limit)
+        try:
+            pipeline.start()
+            last_report = time.time()
+            for frame_result in pipeline.results("display"):
+                if live_source is not None:
+                    live_source.record_latency(frame_result['timestamp'])
+                    if time.time() - last_report >= PIPELINE_REPORT_INTERVAL:
+                        live_source.log_metrics()
+                        last_report = time.time()
+                
+                if headless:
+                    continue
                 
-            # Process frame
-            annotated_frame, speeding_vehicles = detector.process_frame(frame)
+                # Display the annotated frame
+                # Resize frame to 1280x720
+                resized_frame = cv2.resize(frame_result['annotated_frame'], (1280, 720))
+                cv2.imshow("Speed Detection", resized_frame)
+                
+                # Break the loop if 'q' is pressed
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        
+        finally:
+            # Stop the stages and wait for them to exit before saving the results
+            pipeline.stop()
+            if live_source is not None:
+                live_source.close()
+            pipeline.join()
+            pipeline.log_report("display")
+            if live_source is not None:
+                live_source.log_metrics()
+            if self.clips is not None:
+                self.clips.close()
+                self.detection_results['clips_written'] += self.clips.clips_written
+                self.detection_results['clip_dropped_frames'] += self.clips.dropped_frames
+                self.clips = None
             
-            # Save frames with speeding vehicles
-            if speeding_vehicles:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                for vehicle in speeding_vehicles:
-                    track_id = vehicle['track_id']
-                    speed = vehicle['speed']
-                    
-                    if detector.screenshot_count[track_id] < MAX_SCREENSHOTS_PER_VEHICLE:
-                        filename = f"vehicle_{track_id}_{speed:.1f}kmh.jpg"
-                        filepath = os.path.join(OUTPUT_DIR, "speeding", filename)
-                        cv2.imwrite(filepath, annotated_frame)
-                        
-                        detector.screenshot_count[track_id] += 1
-                        
-                        logging.info(f"Speeding vehicle {track_id} detected! Speed: {speed:.1f} km/h")
+            # Save speed data before exiting, then wait for the evidence of the last tracks
+            self.save_speeding_data()
+            self.evidence.close()
+            if record_path and self.frame_shape is not None:
+                self.recorder.save(record_path, video_path, self.frame_shape, self.fps, self.class_names)
+            self.events.emit('run_end', **self.detection_results)
+            if live_source is not None:
+                # A live stream has no end, a restart with --resume continues the event log after this run
+                self.save_checkpoint(video_path, progress['position'])
+            self.events.close()
             
-            # Display the annotated frame
-            # Resize frame to 1280x720
-            resized_frame = cv2.resize(annotated_frame, (1280, 720))
-            cv2.imshow("Speed Detection", resized_frame)
+            # A completed video needs no checkpoint, an interrupted one keeps it
+            if progress['finished'] and live_source is None and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            self.resume_video = None
+            self.resume_position = 0
             
-            # Break the loop if 'q' is pressed
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            if cap is not None:
+                cap.release()
+            if not headless:
+                cv2.destroyAllWindows()
+            logging.info("Speed detection completed")
+        
+        elapsed = time.time() - start_time
+        report = {
+            'video_path': video_path,
+            'frames': self.frame_count - first_frame,
+            'elapsed_seconds': round(elapsed, 2),
+            'fps': round((self.frame_count - first_frame) / elapsed, 1) if elapsed > 0 else 0.0,
+            'speeding_vehicles': self.detection_results['speeding_vehicles'],
+            'stages': pipeline.report("display")
+        }
+        if live_source is not None:
+            report['live'] = live_source.metrics()
+        return report
+
+def roi_region(points, frame_shape):
+    """Bounding rectangle (x, y, w, h) of an ROI polygon clipped to the frame, and its polygon mask"""
+    x, y, w, h = cv2.boundingRect(points)
+    x1, y1 = max(x, 0), max(y, 0)
+    x2, y2 = min(x + w, frame_shape[1]), min(y + h, frame_shape[0])
+    mask = np.zeros((y2 - y1, x2 - x1), np.uint8)
+    cv2.fillPoly(mask, [points - np.array([x1, y1], np.int32)], 255)
+    return (x1, y1, x2 - x1, y2 - y1), mask
+
+def frame_timestamp(cap):
+    """Position of the frame just read from cap, in seconds"""
+    msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if msec > 0:
+        return msec / 1000.0
     
-    except Exception as e:
-        logging.error(f"Error during processing: {str(e)}")
+    # Some backends do not report timestamps, fall back to the frame index
+    return max(cap.get(cv2.CAP_PROP_POS_FRAMES) - 1, 0) / FPS
+
+def read_frame(cap, frame_skip=1):
+    """Decode the next keyframe with its timestamp and video position, or return None at the end.
     
-    finally:
-        # Save speed data before exiting
-        detector.save_speeding_data()
-        
-        cap.release()
-        cv2.destroyAllWindows()
-        logging.info("Speed detection completed")
+    The frame_skip - 1 frames before each keyframe are only grabbed, not
+    decoded. The position is the index of the frame after the keyframe.
+    """
+    for _ in range(frame_skip - 1):
+        if not cap.grab():
+            return None
+    
+    ret, frame = cap.read()
+    if not ret:
+        return None
+    return frame, frame_timestamp(cap), int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+def main():
+    parser = argparse.ArgumentParser(description='Vehicle Speed Detection')
+    parser.add_argument('--headless', action='store_true', default=HEADLESS,
+                        help='Skip all visualization and only annotate frames saved as evidence')
+    parser.add_argument('--frame-skip', type=int, default=FRAME_SKIP,
+                        help='Run tracking on every Nth frame only (1 processes every frame)')
+    parser.add_argument('--detector-interval', type=int, default=DETECTOR_INTERVAL,
+                        help='Run the detector on every Nth processed frame and optical flow in between')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its last checkpoint')
+    parser.add_argument('--record', nargs='?', const=RECORDING_PATH,
+                        help='Save the tracker output of every frame for --replay')
+    parser.add_argument('--replay', nargs='?', const=RECORDING_PATH,
+                        help='Re-run speed estimation on recorded tracker output without inference')
+    parser.add_argument('--pixels-per-meter', type=float, default=PIXELS_PER_METER)
+    parser.add_argument('--speed-limit', type=float, default=SPEED_LIMIT)
+    parser.add_argument('--speed-factor', type=float, default=SPEED_FACTOR)
+    parser.add_argument('--speed-mode', choices=('path', 'trap'), default=SPEED_MODE,
+                        help='Measure along the track history or time vehicles between TRAP_LINES')
+    parser.add_argument('--speed-filter', choices=('kalman', 'mean'), default=SPEED_FILTER,
+                        help='Smooth path speeds with a Kalman filter or a moving average')
+    parser.add_argument('--live', nargs='?', const=LIVE_SOURCE,
+                        help='Track a live RTSP, HTTP MJPEG or named pipe stream, dropping frames that fall behind')
+    parser.add_argument('--realtime', action='store_true',
+                        help='Play VIDEO_PATH back at its real-time rate as a stand-in live source')
+    parser.add_argument('--latency-budget', type=float, default=LIVE_LATENCY_BUDGET,
+                        help='Seconds a live frame may age before it is dropped')
+    parser.add_argument('--load-control', action='store_true', default=LOAD_CONTROL,
+                        help=f'Adapt inference size and detector interval to a {LOAD_TARGET_MS} ms per-frame budget')
+    parser.add_argument('--detection-width', type=int, default=DETECTION_WIDTH,
+                        help='Downscale wider frames to this width for detection and optical flow')
+    parser.add_argument('--output-dir', type=str,
+                        help=f'Output directory (default {OUTPUT_DIR}, or {REPLAY_OUTPUT_DIR} for replays)')
+    args = parser.parse_args()
+    
+    if args.replay:
+        detector = SpeedDetector(pixels_per_meter=args.pixels_per_meter, speed_limit=args.speed_limit,
+                                 output_dir=args.output_dir or REPLAY_OUTPUT_DIR, load_detector=False,
+                                 speed_factor=args.speed_factor, speed_mode=args.speed_mode,
+                                 speed_filter=args.speed_filter)
+        detector.replay(args.replay)
+        return
+    
+    # Initialize speed detector
+    detector = SpeedDetector(pixels_per_meter=args.pixels_per_meter, speed_limit=args.speed_limit,
+                             output_dir=args.output_dir or OUTPUT_DIR,
+                             detector_interval=args.detector_interval, resume=args.resume,
+                             speed_factor=args.speed_factor, speed_mode=args.speed_mode,
+                             speed_filter=args.speed_filter, load_control=args.load_control,
+                             detection_width=args.detection_width)
+    if args.live or args.realtime:
+        if args.live:
+            source = LiveSource(args.live, args.latency_budget)
+        else:
+            source = RealtimeFileSource(VIDEO_PATH, args.latency_budget)
+        detector.process_video(source.source, headless=args.headless, record_path=args.record,
+                               live_source=source)
+        return
+    detector.process_video(VIDEO_PATH, headless=args.headless, frame_skip=args.frame_skip,
+                           record_path=args.record)
 
 # Bookmark-1: End of Section One - Speed Detection System
 """
@@ -0,0 +1,78 @@
+import numpy as np
+
+class KalmanSpeedFilter:
+    """Constant-velocity Kalman filter over the positions of every track.
+
+    Each track slot holds a state (x, y, vx, vy) in metres and m/s with its
+    4x4 covariance in the TrackStore, so one predict and update step runs
+    for all tracks of a frame as batched NumPy operations. Tracks missing
+    from a frame are simply predicted over the longer interval next time.
+    """
+
+    def __init__(self, accel_noise, measurement_noise, initial_speed_std=30.0):
+        self.accel_noise = accel_noise
+        self.measurement_noise = measurement_noise
+        self.initial_speed_std = initial_speed_std
+
+    def update(self, tracks, slots, positions, timestamp):
+        """Fold one position in metres per slot into its filter, return speeds and their std in m/s"""
+        if len(slots) == 0:
+            return np.zeros(0), np.zeros(0)
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        R = self.measurement_noise ** 2
+
+        # Start new tracks at their first position, standing still but with a wide speed prior
+        new = ~tracks.filter_ready[slots]
+        if new.any():
+            started = slots[new]
+            tracks.filter_states[started] = 0.0
+            tracks.filter_states[started, :2] = positions[new]
+            tracks.filter_covariances[started] = np.diag([R, R, self.initial_speed_std ** 2,
+                                                          self.initial_speed_std ** 2])
+            tracks.filter_times[started] = timestamp
+            tracks.filter_ready[started] = True
+
+        active = slots[~new]
+        if len(active):
+            self.step(tracks, active, positions[~new], timestamp - tracks.filter_times[active], R)
+            tracks.filter_times[active] = timestamp
+
+        return self.speeds(tracks, slots)
+
+    def step(self, tracks, slots, measured, dt, R):
+        """Predict every slot over its own dt and correct it with the measured positions"""
+        n = len(slots)
+        F = np.tile(np.eye(4), (n, 1, 1))
+        F[:, 0, 2] = dt
+        F[:, 1, 3] = dt
+
+        # White-noise acceleration, per axis [[dt^4/4, dt^3/2], [dt^3/2, dt^2]]
+        q = self.accel_noise ** 2
+        Q = np.zeros((n, 4, 4))
+        Q[:, [0, 1], [0, 1]] = (q * dt ** 4 / 4)[:, None]
+        Q[:, [0, 1, 2, 3], [2, 3, 0, 1]] = (q * dt ** 3 / 2)[:, None]
+        Q[:, [2, 3], [2, 3]] = (q * dt ** 2)[:, None]
+
+        x = np.einsum('nij,nj->ni', F, tracks.filter_states[slots])
+        P = F @ tracks.filter_covariances[slots] @ F.transpose(0, 2, 1) + Q
+
+        # Only the position is observed, so H picks the first two state entries
+        S = P[:, :2, :2] + R * np.eye(2)
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        x = x + np.einsum('nij,nj->ni', K, measured - x[:, :2])
+        P = P - K @ P[:, :2, :]
+
+        tracks.filter_states[slots] = x
+        tracks.filter_covariances[slots] = (P + P.transpose(0, 2, 1)) / 2
+
+    def speeds(self, tracks, slots):
+        """Speed estimate and its standard deviation along the direction of travel, in m/s"""
+        velocity = tracks.filter_states[slots, 2:]
+        speed = np.linalg.norm(velocity, axis=1)
+        direction = velocity / np.where(speed > 0, speed, 1.0)[:, None]
+        variance = np.einsum('ni,nij,nj->n', direction, tracks.filter_covariances[slots, 2:, 2:], direction)
+
+        # Standing still has no direction, use the larger axis variance
+        still = speed == 0
+        variance[still] = tracks.filter_covariances[slots[still], 2:, 2:].diagonal(axis1=1, axis2=2).max(axis=1)
+        return speed, np.sqrt(np.maximum(variance, 0.0))
@@ -0,0 +1,66 @@
+import numpy as np
+
+class SpeedTrap:
+    """Two virtual trap lines that time each vehicle between its crossings.
+
+    When the newest segment of a track crosses a line, the crossing time is
+    interpolated between its two points, so an update only looks at that
+    segment however long the track is. The speed is the distance between
+    the lines over the time between the two crossings, the way a pair of
+    road-side sensors measures it. Crossing state lives in the TrackStore.
+    """
+
+    def __init__(self, lines, distance):
+        self.lines = np.asarray(lines, np.float64).reshape(2, 2, 2)
+        self.distance = distance
+        self.directions = self.lines[:, 1] - self.lines[:, 0]
+        self.lengths_sq = (self.directions ** 2).sum(axis=1)
+
+    def update(self, tracks, slots, previous_points, previous_positions, previous_times, has_previous):
+        """Record the line crossings of the segments just appended to the given slots"""
+        if len(slots) == 0:
+            return
+        heads = (tracks.heads[slots] - 1) % tracks.history_length
+        points = tracks.points[slots, heads]
+        positions = tracks.positions[slots, heads]
+        times = tracks.times[slots, heads]
+
+        for k, (start, direction) in enumerate(zip(self.lines[:, 0], self.directions)):
+            # Signed side of the line before and after the segment
+            side_before = self.side(previous_points, start, direction)
+            side_after = self.side(points, start, direction)
+            crossing = has_previous & ((side_before > 0) != (side_after > 0)) & ~tracks.crossed[slots, k]
+            if not crossing.any():
+                continue
+
+            # Where along the segment it meets the line, and whether that is between the line's ends
+            index = np.flatnonzero(crossing)
+            fraction = side_before[index] / (side_before[index] - side_after[index])
+            hit = previous_points[index] + fraction[:, None] * (points[index] - previous_points[index])
+            along = ((hit - start) @ direction) / self.lengths_sq[k]
+            within = (along >= 0) & (along <= 1)
+            index, fraction = index[within], fraction[within]
+
+            crossed = slots[index]
+            tracks.crossed[crossed, k] = True
+            tracks.crossing_times[crossed, k] = (previous_times[index]
+                                                 + fraction * (times[index] - previous_times[index]))
+            tracks.crossing_positions[crossed, k] = (previous_positions[index] + fraction[:, None]
+                                                     * (positions[index] - previous_positions[index]))
+
+    def side(self, points, start, direction):
+        """Signed distance-like value telling which side of a line each point is on"""
+        return direction[0] * (points[:, 1] - start[1]) - direction[1] * (points[:, 0] - start[0])
+
+    def speeds(self, tracks, slots, distance=None):
+        """Trap speed in km/h of each slot, 0 until it has crossed both lines.
+
+        Without a fixed distance the distance between the two crossing
+        positions is used, e.g. measured in meters on the ground plane.
+        """
+        done = tracks.crossed[slots].all(axis=1)
+        elapsed = np.abs(tracks.crossing_times[slots, 1] - tracks.crossing_times[slots, 0])
+        if distance is None:
+            distance = np.linalg.norm(tracks.crossing_positions[slots, 1] - tracks.crossing_positions[slots, 0], axis=1)
+        speed_kmh = distance / np.where(elapsed > 0, elapsed, 1.0) * 3.6
+        return np.where(done & (elapsed > 0), speed_kmh, 0.0)
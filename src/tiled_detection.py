@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+try:
+    from ultralytics.engine.results import Boxes
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    from ultralytics.utils import IterableSimpleNamespace, yaml_load
+    from ultralytics.utils.checks import check_yaml
+    TILED_TRACKING = True
+except ImportError:
+    # Tiles are tracked with ultralytics internals, other versions detect without them
+    TILED_TRACKING = False
+from config import *
+
+def tile_grid(region, frame_shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Tiles (x1, y1, x2, y2) of at most tile_size pixels covering a region of the frame.
+
+    Neighbouring tiles overlap, so a vehicle cut by one tile edge is whole
+    in the next tile.
+    """
+    frame_h, frame_w = frame_shape[:2]
+    x1, y1 = max(int(region[0]), 0), max(int(region[1]), 0)
+    x2, y2 = min(int(region[2]), frame_w), min(int(region[3]), frame_h)
+    step = max(tile_size - overlap, 1)
+
+    def starts(low, high):
+        if high - low <= tile_size:
+            return [low]
+        positions = list(range(low, high - tile_size, step))
+        return positions + [high - tile_size]
+
+    return [(x, y, min(x + tile_size, x2), min(y + tile_size, y2))
+            for y in starts(y1, y2) for x in starts(x1, x2)]
+
+def cut_detections(boxes, region, frame_shape, margin=2):
+    """Mask of the boxes (x1, y1, x2, y2) cut off by an edge of their image's region.
+
+    Only region edges inside the frame cut a vehicle, a box at the frame
+    border is as whole as the camera sees it.
+    """
+    frame_h, frame_w = frame_shape[:2]
+    x1, y1, x2, y2 = region
+    return (((boxes[:, 0] <= x1 + margin) & (x1 > 0)) |
+            ((boxes[:, 1] <= y1 + margin) & (y1 > 0)) |
+            ((boxes[:, 2] >= x2 - margin) & (x2 < frame_w)) |
+            ((boxes[:, 3] >= y2 - margin) & (y2 < frame_h)))
+
+def merge_detections(detections, cut, iou=0.5, ios=0.6):
+    """Suppress duplicates among the detections of overlapping images.
+
+    detections holds rows of (x1, y1, x2, y2, confidence, class) in frame
+    pixels, cut marks the rows cut off by an edge of their image. A cut box
+    is dropped when a whole box of another image covers at least ios of it,
+    as its overlap with the whole vehicle is too small for IoU. Of every
+    remaining overlapping group the most confident box is kept.
+    """
+    if len(detections) == 0:
+        return np.zeros((0, 6), np.float32)
+    cut = np.asarray(cut, bool)
+    whole = detections[~cut]
+    if cut.any() and len(whole):
+        fragments = detections[cut]
+        # Intersection of every cut box with every whole box, over the cut box's area
+        low = np.maximum(fragments[:, None, :2], whole[None, :, :2])
+        high = np.minimum(fragments[:, None, 2:4], whole[None, :, 2:4])
+        intersection = np.clip(high - low, 0, None).prod(axis=2)
+        area = (fragments[:, 2:4] - fragments[:, :2]).prod(axis=1)
+        covered = intersection.max(axis=1) / np.maximum(area, 1e-6)
+        detections = np.concatenate([whole, fragments[covered < ios]])
+    rects = np.column_stack([detections[:, :2], detections[:, 2:4] - detections[:, :2]])
+    keep = cv2.dnn.NMSBoxes(rects.tolist(), detections[:, 4].tolist(), 0.0, iou)
+    return detections[np.asarray(keep, np.int64).reshape(-1)]
+
+def create_tracker(frame_rate):
+    """ByteTrack with the settings YOLOv8 tracking uses by default"""
+    args = IterableSimpleNamespace(**yaml_load(check_yaml('bytetrack.yaml')))
+    return BYTETracker(args=args, frame_rate=int(round(frame_rate)))
+
+def track_detections(tracker, detections, frame):
+    """Update the tracker with merged detections, return the track IDs, xywh boxes and classes"""
+    tracks = tracker.update(Boxes(detections, frame.shape[:2]), frame)
+    if len(tracks) == 0:
+        return [], np.zeros((0, 4), np.float32), []
+
+    x1, y1, x2, y2 = tracks[:, 0], tracks[:, 1], tracks[:, 2], tracks[:, 3]
+    boxes = np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1).astype(np.float32)
+    return tracks[:, 4].astype(int).tolist(), boxes, tracks[:, 6].astype(int).tolist()
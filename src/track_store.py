@@ -0,0 +1,185 @@
+import numpy as np
+
+
+class TrackStore:
+    """Ring-buffer storage for per-vehicle track points and speed samples.
+
+    Every track ID owns one slot (a row) in preallocated NumPy arrays, so
+    appending a point is an index write instead of a list append/pop(0), and
+    the path length of all active tracks is computed in one vectorized pass.
+    """
+
+    # Per-slot arrays, grown together when the slot table fills up
+    _ARRAYS = ('points', 'positions', 'times', 'segments', 'counts', 'heads', 'speeds', 'speed_counts', 'speed_heads',
+               'class_ids', 'first_seen', 'last_seen', 'misses', 'crossed', 'crossing_times', 'crossing_positions',
+               'filter_ready', 'filter_states', 'filter_covariances', 'filter_times')
+
+    def __init__(self, history_length, speed_history_length, initial_slots=64):
+        self.history_length = history_length
+        self.speed_history_length = speed_history_length
+        self.slot_of = {}
+        self.free_slots = []
+        self.capacity = 0
+
+        self.points = np.zeros((0, history_length, 2))
+        self.positions = np.zeros((0, history_length, 2))  # where segment lengths are measured
+        self.times = np.zeros((0, history_length))
+        self.segments = np.zeros((0, history_length))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.heads = np.zeros(0, dtype=np.int64)
+        self.speeds = np.zeros((0, speed_history_length))
+        self.speed_counts = np.zeros(0, dtype=np.int64)
+        self.speed_heads = np.zeros(0, dtype=np.int64)
+        self.class_ids = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0, dtype=np.int64)
+        self.last_seen = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)  # detection frames since last seen
+        self.crossed = np.zeros((0, 2), dtype=bool)  # speed trap lines crossed
+        self.crossing_times = np.zeros((0, 2))
+        self.crossing_positions = np.zeros((0, 2, 2))
+        self.filter_ready = np.zeros(0, dtype=bool)  # Kalman speed filter started
+        self.filter_states = np.zeros((0, 4))  # x, y, vx, vy
+        self.filter_covariances = np.zeros((0, 4, 4))
+        self.filter_times = np.zeros(0)
+        self._grow(initial_slots)
+
+    def _grow(self, new_capacity):
+        """Extend the slot table to hold new_capacity tracks"""
+        extra = new_capacity - self.capacity
+        for name in self._ARRAYS:
+            array = getattr(self, name)
+            pad = np.zeros((extra,) + array.shape[1:], dtype=array.dtype)
+            setattr(self, name, np.concatenate([array, pad]))
+
+        # Hand out the lowest free slot first
+        self.free_slots.extend(range(new_capacity - 1, self.capacity - 1, -1))
+        self.capacity = new_capacity
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, track_id):
+        return track_id in self.slot_of
+
+    def slots_for(self, track_ids):
+        """Return the slot of every track ID, allocating slots for new IDs"""
+        slots = np.empty(len(track_ids), dtype=np.int64)
+        for i, track_id in enumerate(track_ids):
+            slot = self.slot_of.get(track_id)
+            if slot is None:
+                if not self.free_slots:
+                    self._grow(self.capacity * 2)
+                slot = self.free_slots.pop()
+                self.slot_of[track_id] = slot
+            slots[i] = slot
+        return slots
+
+    def active_slots(self):
+        """Slots of every stored track"""
+        return np.fromiter(self.slot_of.values(), dtype=np.int64, count=len(self.slot_of))
+
+    def touch(self, slots, class_ids, frame_index):
+        """Record a detection frame in which the given slots were seen"""
+        self.misses[self.active_slots()] += 1
+        new = slots[self.counts[slots] == 0]
+        self.first_seen[new] = frame_index
+        self.last_seen[slots] = frame_index
+        self.misses[slots] = 0
+        self.class_ids[slots] = class_ids
+
+    def stale_ids(self, max_misses):
+        """Track IDs missed in more than max_misses consecutive detection frames"""
+        if not self.slot_of:
+            return []
+        track_ids = list(self.slot_of)
+        stale = np.flatnonzero(self.misses[self.active_slots()] > max_misses)
+        return [track_ids[i] for i in stale]
+
+    def release(self, track_id):
+        """Evict a track and return its slot to the free list"""
+        slot = self.slot_of.pop(track_id)
+        for name in self._ARRAYS:
+            getattr(self, name)[slot] = 0
+        self.free_slots.append(slot)
+
+    def append_points(self, slots, centers, timestamp, positions=None):
+        """Append one center point, observed at timestamp seconds, to each of the given slots.
+
+        Segment lengths are measured between the positions, e.g. ground-plane
+        metres, which default to the pixel centers themselves.
+        """
+        if len(slots) == 0:
+            return
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        positions = centers if positions is None else np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        heads = self.heads[slots]
+        counts = self.counts[slots]
+
+        # Length of the segment joining each new point to the previous one
+        delta = positions - self.positions[slots, (heads - 1) % self.history_length]
+        segments = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+        segments[counts == 0] = 0.0
+
+        self.points[slots, heads] = centers
+        self.positions[slots, heads] = positions
+        self.times[slots, heads] = timestamp
+        self.segments[slots, heads] = segments
+        self.heads[slots] = (heads + 1) % self.history_length
+        self.counts[slots] = np.minimum(counts + 1, self.history_length)
+
+    def newest(self, slots):
+        """Newest point, position and time of each slot, and whether it has any point yet"""
+        heads = (self.heads[slots] - 1) % self.history_length
+        return (self.points[slots, heads], self.positions[slots, heads], self.times[slots, heads],
+                self.counts[slots] > 0)
+
+    def path_lengths(self, slots):
+        """Total distance travelled, in position units, over the retained window of each slot"""
+        counts = self.counts[slots]
+        oldest = (self.heads[slots] - counts) % self.history_length
+        # The oldest retained point's segment leads to a point already dropped
+        return self.segments[slots].sum(axis=1) - self.segments[slots, oldest]
+
+    def time_spans(self, slots):
+        """Seconds between the oldest and newest retained point of each slot"""
+        counts = self.counts[slots]
+        heads = self.heads[slots]
+        newest = self.times[slots, (heads - 1) % self.history_length]
+        oldest = self.times[slots, (heads - counts) % self.history_length]
+        return newest - oldest
+
+    def append_speeds(self, slots, speeds):
+        """Append one speed sample to each of the given slots"""
+        if len(slots) == 0:
+            return
+        heads = self.speed_heads[slots]
+        self.speeds[slots, heads] = speeds
+        self.speed_heads[slots] = (heads + 1) % self.speed_history_length
+        self.speed_counts[slots] = np.minimum(self.speed_counts[slots] + 1, self.speed_history_length)
+
+    def recent_speed_means(self, slots, current_speeds, window=10):
+        """Mean of the last `window` speeds, or the current speed for short histories.
+
+        The window is clamped to the retained speed history, a longer one
+        could never fill up.
+        """
+        if len(slots) == 0:
+            return np.zeros(0)
+        window = max(min(window, self.speed_history_length), 1)
+        idx = (self.speed_heads[slots][:, None] - 1 - np.arange(window)) % self.speed_history_length
+        recent = self.speeds[slots[:, None], idx].mean(axis=1)
+        return np.where(self.speed_counts[slots] >= window, recent, current_speeds)
+
+    def track(self, track_id):
+        """Retained points of a track, oldest first"""
+        slot = self.slot_of[track_id]
+        count = self.counts[slot]
+        idx = (self.heads[slot] - count + np.arange(count)) % self.history_length
+        return self.points[slot, idx]
+
+    def speed_samples(self, track_id):
+        """Retained speed samples of a track, oldest first"""
+        slot = self.slot_of[track_id]
+        count = self.speed_counts[slot]
+        idx = (self.speed_heads[slot] - count + np.arange(count)) % self.speed_history_length
+        return self.speeds[slot, idx].tolist()
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+
+from clip_recorder import ClipRecorder, clip_track_id
+
+
+def record_violation(output_dir, run):
+    clips = ClipRecorder(output_dir, run=run, pre_seconds=0.2, post_seconds=0.2)
+    clips.trigger(1, 0.2)
+    for i in range(6):
+        clips.push(np.full((48, 64, 3), i * 40, np.uint8), i * 0.1)
+    clips.close()
+    return clips
+
+
+def test_clips_of_a_new_run_do_not_overwrite_older_ones(tmp_path):
+    first = record_violation(str(tmp_path), 'short_20240101_120000')
+    second = record_violation(str(tmp_path), 'short_20240101_130000')
+
+    assert first.clips_written == second.clips_written == 1
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 2
+    assert [clip_track_id(name) for name in names] == [1, 1]
+
+
+def test_drain_with_lock_held_waits_for_queued_clips(tmp_path):
+    clips = ClipRecorder(str(tmp_path), run='short', pre_seconds=0.1, post_seconds=0.1)
+    for track_id in range(1, 4):
+        clips.trigger(track_id, 0.1)
+    for i in range(4):
+        clips.push(np.full((48, 64, 3), i * 40, np.uint8), i * 0.1)
+
+    # The single writer must get past each finished clip to the next one
+    with clips.lock:
+        clips.drain()
+        assert not clips.writes
+    assert clips.clips_written == 3
+    clips.close()
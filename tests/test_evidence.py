@@ -0,0 +1,29 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('ultralytics')
+
+from config import EVIDENCE_BEST_K
+from speed_detection import SpeedDetector
+
+
+def test_best_views_with_the_same_speed_are_all_written(tmp_path):
+    detector = SpeedDetector(output_dir=str(tmp_path), load_detector=False)
+    detector.open_outputs()
+
+    # Constant speed, as in trap mode, with a different view in every frame
+    rng = np.random.default_rng(0)
+    vehicle = {'track_id': 1, 'box': [320, 240, 120, 80], 'speed': 95.0}
+    for frame_count in range(1, EVIDENCE_BEST_K + 3):
+        detector.frame_count = frame_count
+        frame = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        detector.collect_evidence(frame, [vehicle])
+
+    assert detector.write_evidence(1) == EVIDENCE_BEST_K
+    detector.evidence.close()
+    detector.events.close()
+
+    names = os.listdir(os.path.join(tmp_path, 'speeding'))
+    assert len([name for name in names if name.startswith('vehicle_1_') and name.endswith('.jpg')]) == EVIDENCE_BEST_K
+    assert len([name for name in names if name.startswith('vehicle_1_') and name.endswith('.json')]) == EVIDENCE_BEST_K
@@ -0,0 +1,33 @@
+import pytest
+
+from pipeline import Pipeline
+
+
+def test_stage_error_reaches_the_caller():
+    frames = iter(range(10))
+
+    def track(frame):
+        if frame == 3:
+            raise ValueError("bad frame")
+        return frame
+
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_source("decode", lambda: next(frames, None))
+    pipeline.add_stage("track", track)
+    pipeline.start()
+
+    with pytest.raises(ValueError, match="bad frame"):
+        list(pipeline.results())
+    pipeline.join()
+
+
+def test_completed_pipeline_yields_every_item():
+    frames = iter(range(10))
+
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_source("decode", lambda: next(frames, None))
+    pipeline.add_stage("double", lambda frame: frame * 2)
+    pipeline.start()
+
+    assert list(pipeline.results()) == [frame * 2 for frame in range(10)]
+    pipeline.join()
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ultralytics')
+
+from speed_detection import SpeedDetector
+
+# 10 pixels per metre, square to the road
+IMAGE_POINTS = [(0, 0), (100, 0), (100, 100), (0, 100)]
+GROUND_POINTS = [(0, 0), (10, 0), (10, 10), (0, 10)]
+
+
+@pytest.mark.parametrize('points', [2, 5, 10, 30])
+def test_ground_plane_speed_is_exact(tmp_path, points):
+    detector = SpeedDetector(output_dir=str(tmp_path), load_detector=False,
+                             image_points=IMAGE_POINTS, ground_points=GROUND_POINTS)
+    detector.init_roi((720, 1280, 3))
+    slots = detector.tracks.slots_for([1])
+
+    # 20 m/s along the road, sampled every 0.2 s
+    for i in range(points):
+        timestamp = 0.2 * i
+        position = np.array([[4.0 * i, 5.0]], np.float32)
+        detector.tracks.append_points(slots, position * 10, timestamp, position)
+
+    assert detector.calculate_speed(slots)[0] == pytest.approx(72.0, rel=1e-4)
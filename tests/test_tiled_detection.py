@@ -0,0 +1,44 @@
+import numpy as np
+
+from tiled_detection import tile_grid, cut_detections, merge_detections
+
+FRAME_SHAPE = (720, 1280, 3)
+
+def detect(boxes, region, confidence=0.8):
+    """Detections of one image as merge_detections takes them, with their cut mask"""
+    boxes = np.asarray(boxes, np.float32).reshape(-1, 4)
+    rows = np.column_stack([boxes, np.full(len(boxes), confidence), np.full(len(boxes), 2)])
+    return rows.astype(np.float32), cut_detections(boxes, region, FRAME_SHAPE)
+
+def merge(*images):
+    detections, cut = zip(*images)
+    return merge_detections(np.concatenate(detections), np.concatenate(cut))
+
+def test_tiles_overlap_and_cover_region():
+    tiles = tile_grid((0, 300, 1280, 520), FRAME_SHAPE)
+
+    assert tiles[0][0] == 0 and tiles[-1][2] == 1280
+    assert all(tile[1] == 300 and tile[3] == 520 for tile in tiles)
+    assert all(left[2] > right[0] for left, right in zip(tiles, tiles[1:]))
+
+def test_vehicle_straddling_tile_seam_is_detected_once():
+    left, right = tile_grid((0, 300, 1280, 520), FRAME_SHAPE)[:2]
+    vehicle = (600, 380, 700, 420)
+    # The left tile ends at 640, so it only sees the front of the vehicle, more confidently than the whole
+    fragment = (600, 380, left[2], 420)
+
+    merged = merge(detect([fragment], left, confidence=0.9), detect([vehicle], right, confidence=0.6))
+
+    assert len(merged) == 1
+    np.testing.assert_allclose(merged[0, :4], vehicle)
+
+def test_neighbouring_vehicles_are_kept():
+    tile = tile_grid((0, 300, 1280, 520), FRAME_SHAPE)[0]
+    vehicles = [(100, 380, 180, 420), (170, 385, 250, 425)]
+
+    assert len(merge(detect(vehicles, tile))) == 2
+
+def test_vehicle_at_frame_border_is_not_cut():
+    tile = tile_grid((0, 300, 1280, 520), FRAME_SHAPE)[0]
+
+    assert not cut_detections(np.array([[0, 380, 60, 420]], np.float32), tile, FRAME_SHAPE).any()